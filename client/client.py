@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 import time
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,8 +24,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'last_refresh' not in st.session_state:
-    st.session_state.last_refresh = 0
 if 'post_auth_loading' not in st.session_state:
     st.session_state.post_auth_loading = False
 if 'auth_loading_start' not in st.session_state:
@@ -39,17 +38,34 @@ if st.query_params.get('auth') == 'success':
 
 st.markdown("<h1 style='text-align: center; color: #4A90E2;'>Applyst</h1><h3 style='text-align: center; color: #666;'>Auto Job Application Tracker</h3>", unsafe_allow_html=True)
 
+BACKEND = f"{os.getenv('BACKEND_URL', 'http://localhost')}:{os.getenv('BACKEND_PORT', '5000')}"
+
 # API helper
 def api(endpoint, method='GET', data=None):
     try:
-        response = getattr(requests, method.lower())(f"{os.getenv("BACKEND_URL", "http://localhost")}:{os.getenv("BACKEND_PORT", "5000")}{endpoint}", json=data)
+        response = getattr(requests, method.lower())(f"{BACKEND}{endpoint}", json=data)
         return response.status_code == 200, response.json() if response.content else None
     except:
         return False, None
 
+# Conditional GET: an unchanged board comes back as an empty 304 and the cached copy is reused
+def get_applications():
+    try:
+        headers = {"If-None-Match": st.session_state.apps_etag} if st.session_state.get('apps_etag') else {}
+        response = requests.get(f"{BACKEND}/api/applications", headers=headers)
+        if response.status_code == 304:
+            return True, st.session_state.apps_cache
+        if response.status_code == 200:
+            st.session_state.apps_etag, st.session_state.apps_cache = response.headers.get("ETag"), response.json()
+            st.session_state.apps_version = int(response.headers.get("X-Applications-Version", 0))
+            return True, st.session_state.apps_cache
+        return False, None
+    except:
+        return False, None
+
 # Get data
 monitor_ok, monitor = api("/api/monitor/status")
-apps_ok, apps = api("/api/applications")
+apps_ok, apps = get_applications()
 if not apps_ok:
     st.error("⚠️ Backend not running. Start server: `cd server && python app.py`")
     apps = {"Applied": [], "Interview": [], "Offer": [], "Rejected": []}
@@ -135,11 +151,6 @@ with st.sidebar:
             else:
                 st.error("Please fill in both company and position")
 
-# Auto-refresh (skip during loading)
-if not st.session_state.post_auth_loading and monitoring and time.time() - st.session_state.last_refresh > 10:
-    st.session_state.last_refresh = time.time()
-    st.rerun()
-
 stages = ["Applied", "Interview", "Offer", "Rejected"]
 colors = ["#4A90E2", "#F39C12", "#27AE60", "#E74C3C"]
 emojis = ["📄", "🎤", "🎉", "❌"]
@@ -201,3 +212,30 @@ if sum(len(apps.get(stage, [])) for stage in stages) == 0:
             <p>Connect your Gmail to start automatic tracking, or add applications manually.</p>
         </div>
     """, unsafe_allow_html=True)
+
+# Live updates: wait on the server's event stream and rerun as soon as the board changes
+def wait_for_board_change():
+    try:
+        with requests.get(f"{BACKEND}/api/events?heartbeat=2", stream=True, timeout=(5, 30)) as response:
+            live, event = st.empty(), None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line.split(":", 1)[1].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line.split(":", 1)[1])
+                    if event == "hello" and data.get("version") != st.session_state.get("apps_version"):
+                        return  # changed between loading the board and subscribing
+                    if event in ("application", "resync"):
+                        return
+                    if event == "progress":
+                        backfill = f" · backfill {data['backfill']['percent']}%" if data.get("backfill") and data["backfill"]["status"] == "running" else ""
+                        live.caption(f"🟢 Live · {data['processed_emails']} emails processed{backfill}")
+                elif line.startswith(": heartbeat"):
+                    # Any st call lets Streamlit interrupt this wait when the user interacts with the page
+                    live.caption(f"🟢 Live · {time.strftime('%H:%M:%S')}")
+    except (requests.RequestException, ValueError):
+        time.sleep(5)
+
+if monitoring and not st.session_state.post_auth_loading:
+    wait_for_board_change()
+    st.rerun()
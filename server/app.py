@@ -1,9 +1,17 @@
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, request, jsonify, redirect, Response, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
+import csv
 import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from itertools import islice
 from dotenv import load_dotenv
-from services.email_monitor import initialize_monitor, get_monitor
+from services.email_monitor import initialize_monitor, get_monitor, is_relevant
+from services.application_store import ApplicationStore, STAGES, STAGE_MAPPING, normalize_key
+from services.event_bus import get_event_bus, format_sse
+from utils.application_io import FORMATS, export_lines, iter_import_rows
 from utils import db
 
 load_dotenv()
@@ -13,29 +21,149 @@ CORS(app, supports_credentials=True)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
 
 current_user_id = None
+ANALYZE_WORKERS = int(os.getenv('ANALYZE_WORKERS', 4))
+ANALYZE_CHUNK_SIZE = int(os.getenv('ANALYZE_CHUNK_SIZE', 10))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+MAX_REPORTED_ERRORS = 1000
+
+events = get_event_bus()
+applications = ApplicationStore(on_change=lambda version, op, app: events.publish('application', {'op': op, 'version': version, 'application': app}))
+email_monitor = initialize_monitor(applications)
 
-applications = []
-app_counter = [1]
-email_monitor = initialize_monitor(applications, app_counter)
-
-def create_app(company, position, stage):
-    app_dict = {
-        "id": app_counter[0],
-        "company": company,
-        "position": position,
-        "stage": stage,
-        "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    app_counter[0] += 1
-    return app_dict
+QUERY_PARAMS = {"stage", "q", "date_from", "date_to", "sort", "limit", "cursor"}
 
 @app.route("/api/applications", methods=["GET"])
 def get_applications():
-    grouped = {"Applied": [], "Interview": [], "Offer": [], "Rejected": []}
-    for app in applications:
-        if (stage := app.get("stage", "Applied")) in grouped:
-            grouped[stage].append(app)
-    return jsonify(grouped)
+    if QUERY_PARAMS & set(request.args):
+        return query_applications()
+    # Cheap pre-check: an unchanged store answers 304 without building the payload
+    if request.if_none_match.contains(f"apps-{applications.version}"):
+        return "", 304, {"ETag": f'"apps-{applications.version}"'}
+    version, grouped = applications.snapshot()
+    response = jsonify(grouped)
+    response.set_etag(f"apps-{version}")
+    response.headers["X-Applications-Version"] = str(version)
+    return response
+
+def query_applications():
+    """Filtered, sorted, cursor-paginated listing; the filtering runs in SQL against the user's stored applications."""
+    if not current_user_id:
+        return jsonify({"error": "Connect Gmail to query stored applications"}), 409
+    stages = [s for value in request.args.getlist("stage") for s in value.split(",") if s]
+    if bad := [s for s in stages if s not in STAGES]:
+        return jsonify({"error": f"Unknown stage(s): {', '.join(bad)}"}), 400
+    # Stored dates are 'YYYY-MM-DD HH:MM:SS' text, so filters are normalized to that before comparing
+    dates = {}
+    for param in ("date_from", "date_to"):
+        try:
+            if value := request.args.get(param):
+                parsed = datetime.fromisoformat(value)
+                if param == "date_to" and len(value) == 10:
+                    # A bare end date covers that whole day
+                    parsed = parsed.replace(hour=23, minute=59, second=59)
+                dates[param] = parsed.strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return jsonify({"error": f"{param} must be an ISO date (YYYY-MM-DD)"}), 400
+
+    # Rows still in the write-behind buffer would otherwise be missing from the query
+    email_monitor.write_buffer.flush()
+    try:
+        rows, next_cursor = db.query_applications(
+            current_user_id, stages=stages, text=request.args.get("q"), date_from=dates.get("date_from"),
+            date_to=dates.get("date_to"), sort=request.args.get("sort", "-date_added"),
+            limit=request.args.get("limit", 50, type=int), cursor=request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Report the ids the rest of the API (PUT/DELETE) knows these applications by
+    for row in rows:
+        if app := applications.find(row["company"], row["position"]):
+            row["id"] = app["id"]
+    return jsonify({"applications": rows, "next_cursor": next_cursor})
+
+@app.route("/api/applications/export", methods=["GET"])
+def export_applications():
+    if (fmt := request.args.get("format", "csv")) not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+    if not current_user_id:
+        return jsonify({"error": "Connect Gmail to export stored applications"}), 409
+    email_monitor.write_buffer.flush()
+    # Rows go from the SQLite cursor to the socket without ever being collected into a list
+    return Response(stream_with_context(export_lines(db.iter_applications(current_user_id), fmt)),
+                    mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+                    headers={"Content-Disposition": f"attachment; filename=applications.{fmt}"})
+
+@app.route("/api/applications/import", methods=["POST"])
+def import_applications():
+    """Upsert applications from an uploaded CSV/JSONL file ('file') in batched transactions, reporting rejected rows."""
+    if not (upload := request.files.get("file")):
+        return jsonify({"error": "Upload a CSV or JSONL file as 'file'"}), 400
+    fmt = request.form.get("format") or ("jsonl" if (upload.filename or "").lower().endswith((".jsonl", ".ndjson", ".json")) else "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}"}), 400
+
+    imported, failed, errors, batch = 0, 0, [], []
+    email_monitor.write_buffer.flush()
+
+    def write(batch):
+        if current_user_id:
+            db.save_applications_batch(current_user_id, batch)
+        else:
+            for company, position, stage, _ in batch:
+                applications.upsert(company, position, stage)
+
+    try:
+        for number, row, error in iter_import_rows(upload.stream, fmt, STAGES):
+            if error:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "error": error})
+                continue
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                write(batch)
+                imported, batch = imported + len(batch), []
+        if batch:
+            write(batch)
+            imported += len(batch)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"Unreadable upload: {e}", "imported": imported, "failed": failed, "errors": errors}), 400
+    finally:
+        # The store mirrors the DB; one reload picks up every imported row (and notifies live clients once)
+        if current_user_id and imported:
+            applications.load(db.get_user_applications(current_user_id))
+
+    return jsonify({"imported": imported, "failed": failed, "errors": errors, "errors_truncated": failed > len(errors)})
+
+@app.route("/api/applications/changes", methods=["GET"])
+def get_application_changes():
+    if (since := request.args.get("since", type=int)) is None:
+        return jsonify({"error": "since (an application version) is required"}), 400
+    version, changes = applications.changes_since(since)
+    if changes is None:
+        # Too far behind the change log: the client has to take a full snapshot instead
+        version, grouped = applications.snapshot()
+        return jsonify({"version": version, "full": True, "applications": grouped})
+    return jsonify({"version": version, "full": False, "changes": changes})
+
+@app.route("/api/events", methods=["GET"])
+def event_stream():
+    """Server-sent events: application changes, monitor progress, and a comment heartbeat while idle."""
+    heartbeat = min(30, max(1, request.args.get("heartbeat", 15, type=int)))
+    subscription = events.subscribe()
+
+    def stream():
+        try:
+            # Tells the client which version the stream starts at, so it can catch up via /api/applications/changes
+            yield format_sse({'id': None, 'type': 'hello', 'data': {'version': applications.version}})
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                yield format_sse(event) if event else ": heartbeat\n\n"
+        finally:
+            subscription.close()
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/applications", methods=["POST"])
 def add_application():
@@ -44,44 +172,34 @@ def add_application():
         return jsonify({"error": "Company and position are required"}), 400
     
     company, position, stage = data["company"], data["position"], data.get("stage", "Applied")
-    existing = next((app for app in applications if 
-                    app["company"].lower() == company.lower() and 
-                    app["position"].lower() == position.lower()), None)
-    
-    if existing:
-        existing.update({"stage": stage, "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-        if current_user_id:
-            db.save_application(current_user_id, company, position, stage)
-        return jsonify({"message": "Application updated", "application": existing})
-    
-    new_app = create_app(company, position, stage)
-    applications.append(new_app)
+    application, action = applications.upsert(company, position, stage)
     if current_user_id:
-        db.save_application(current_user_id, company, position, stage)
-    return jsonify({"message": "Application added", "application": new_app})
+        # Through the monitor's buffer so an older row it still holds for this key can't overwrite the edit
+        email_monitor.write_buffer.add(current_user_id, company, position, stage)
+        email_monitor.write_buffer.flush()
+    return jsonify({"message": f"Application {action}", "application": application})
 
 @app.route("/api/applications/<int:app_id>", methods=["PUT"])
 def update_application(app_id):
     data = request.get_json()
-    if not (stage := data.get("stage")) or stage not in ["Applied", "Interview", "Offer", "Rejected"]:
+    if not (stage := data.get("stage")) or stage not in STAGES:
         return jsonify({"error": "Valid stage required"}), 400
     
-    if not (app := next((app for app in applications if app["id"] == app_id), None)):
+    if not (app := applications.update_stage(app_id, stage)):
         return jsonify({"error": "Application not found"}), 404
     
-    app.update({"stage": stage, "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
     if current_user_id:
-        db.save_application(current_user_id, app["company"], app["position"], stage)
+        email_monitor.write_buffer.add(current_user_id, app["company"], app["position"], stage)
+        email_monitor.write_buffer.flush()
     return jsonify({"message": "Application updated", "application": app})
 
 @app.route("/api/applications/<int:app_id>", methods=["DELETE"])
 def delete_application(app_id):
-    global applications
-    applications = [app for app in applications if app["id"] != app_id]
-    if current_user_id:
+    if (deleted := applications.delete(app_id)) and current_user_id:
         try:
-            db.cursor.execute("DELETE FROM applications WHERE id=? AND user_id=?", (app_id, current_user_id))
-            db.conn.commit()
+            # A row still pending in the buffer would bring the application back on its next flush
+            email_monitor.write_buffer.discard(current_user_id, deleted["company"], deleted["position"])
+            db.delete_application(current_user_id, deleted["company"], deleted["position"])
         except:
             pass
     return jsonify({"message": "Application deleted"})
@@ -115,16 +233,15 @@ def gmail_oauth_callback():
                 import threading
                 global current_user_id
                 current_user_id = db.ensure_user(result)
-                applications.clear()
                 loaded_apps = db.get_user_applications(current_user_id)
                 print(f"✅ Loaded {len(loaded_apps)} applications from DB for {result}")
                 for app in loaded_apps:
                     print(f"  • {app['company']} - {app['position']} ({app['stage']})")
-                applications.extend(loaded_apps)
-                app_counter[0] = max([a['id'] for a in applications], default=0) + 1
-                monitor.set_applications_ref(applications, app_counter)
+                applications.load(loaded_apps)
+                monitor.set_user(current_user_id)
 
-                threading.Timer(1.0, lambda: monitor.start_monitoring()).start()
+                # A new user's board starts empty; the backfill resumes (or skips) an earlier run for returning users
+                threading.Timer(1.0, lambda: monitor.start_monitoring() and monitor.start_backfill()).start()
             except:
                 pass
             return redirect(f'{os.getenv("FRONTEND_URL", "http://localhost")}:{os.getenv("FRONTEND_PORT", 8501)}?auth=success')
@@ -138,12 +255,37 @@ def get_monitor_status():
         status = monitor.get_status()
         status['total_applications'] = len(applications)
         return jsonify(status)
-    return jsonify({'is_running': False, 'gmail_connected': False, 'gmail_email': None, 'gemini_available': False, 'processed_emails': 0, 'check_interval': 5, 'total_applications': len(applications)})
+    return jsonify({'is_running': False, 'gmail_connected': False, 'gmail_email': None, 'gemini_available': False, 'processed_emails': 0, 'check_interval': None, 'total_applications': len(applications)})
 
 @app.route("/api/monitor/scan", methods=["POST"])
 def manual_scan():
     return jsonify({"message": "Manual scan completed"}) if (monitor := get_monitor()) and monitor.manual_scan() else (jsonify({"error": "Manual scan failed or monitoring not running"}), 400)
 
+@app.route("/api/monitor/backfill", methods=["POST"])
+def start_backfill():
+    if not (monitor := get_monitor()):
+        return jsonify({"error": "Monitor not available"}), 400
+    data = request.get_json(silent=True) or {}
+    if (months := data.get("months")) is not None and (not isinstance(months, int) or months < 1):
+        return jsonify({"error": "months must be a positive integer"}), 400
+    if not monitor.start_backfill(months, bool(data.get("restart"))):
+        return jsonify({"error": "Backfill already running or complete, monitoring not started, or Gmail not connected", "backfill": monitor.backfill.progress()}), 409
+    return jsonify({"message": "Backfill started", "backfill": monitor.backfill.progress()}), 202
+
+@app.route("/api/monitor/polling", methods=["PUT"])
+def set_polling_bounds():
+    if not (monitor := get_monitor()):
+        return jsonify({"error": "Monitor not available"}), 400
+    data = request.get_json(silent=True) or {}
+    min_seconds, max_seconds = data.get("min_seconds"), data.get("max_seconds")
+    if any(v is not None and (not isinstance(v, (int, float)) or v < 1) for v in (min_seconds, max_seconds)):
+        return jsonify({"error": "min_seconds and max_seconds must be numbers >= 1"}), 400
+    try:
+        monitor.set_poll_bounds(min_seconds, max_seconds)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": "Polling bounds updated", "polling": monitor.scheduler.stats()})
+
 @app.route("/api/monitor/stop", methods=["POST"])
 def stop_monitoring():
     if monitor := get_monitor():
@@ -151,6 +293,30 @@ def stop_monitoring():
         return jsonify({"message": "Email monitoring stopped"})
     return jsonify({"error": "Monitor not available"}), 400
 
+_analyzer, _analyzer_lock = None, threading.Lock()
+
+def get_analyzer():
+    """The monitor's long-lived analyzer, or one shared instance when the monitor has none; None if Gemini isn't configured."""
+    global _analyzer
+    if (monitor := get_monitor()) and monitor.analyzer:
+        return monitor.analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            try:
+                from utils.gemini_analyzer import GeminiEmailAnalyzer
+                _analyzer = GeminiEmailAnalyzer()
+            except (ImportError, ValueError):
+                return None
+        return _analyzer
+
+def apply_analysis(result, advance_only=True):
+    """Upsert the application an analysis points at; returns (action or None, (company, position, stage) to persist or None)."""
+    if 'error' in result or not is_relevant(result):
+        return None, None
+    company, job, stage = result['company_name'], result['job_title'], STAGE_MAPPING.get(result.get('interview_stage'), 'Applied')
+    _, action = applications.upsert(company, job, stage, advance_only=advance_only)
+    return action, ((company, job, stage) if action != 'unchanged' else None)
+
 @app.route("/api/analyze-email", methods=["POST"])
 def analyze_email():
     try:
@@ -158,40 +324,80 @@ def analyze_email():
         if not (subject := data.get('email_subject', '')) and not (body := data.get('email_body', '')):
             return jsonify({"error": "Email subject or body is required"}), 400
         
-        from utils.gemini_analyzer import GeminiEmailAnalyzer
-        result = GeminiEmailAnalyzer().analyze_email_for_interview_stage(subject, body, "")
-        
-        company, job, stage, confidence = result.get('company_name'), result.get('job_title'), result.get('interview_stage'), result.get('confidence', 0)
-        stage_map = {'application_received': 'Applied', 'phone_screen': 'Interview', 'technical_interview': 'Interview', 'behavioral_interview': 'Interview', 'final_interview': 'Interview', 'offer': 'Offer', 'rejected': 'Rejected'}
-        dashboard_stage = stage_map.get(stage, 'Applied')
+        if not (analyzer := get_analyzer()):
+            return jsonify({"error": "Gemini analyzer not available"}), 500
+        result = analyzer.analyze_email_for_interview_stage(subject, data.get('email_body', ''), "")
         
-        if confidence >= 30 and company and job:
-            existing = next((app for app in applications if app["company"].lower() == company.lower() and app["position"].lower() == job.lower()), None)
-            
-            if not existing:
-                applications.append(create_app(company, job, dashboard_stage))
-                if current_user_id:
-                    db.save_application(current_user_id, company, job, dashboard_stage)
-                message = "Email analyzed and application added automatically"
-            else:
-                stage_order = ['Applied', 'Interview', 'Offer', 'Rejected']
-                if stage_order.index(dashboard_stage) > stage_order.index(existing.get('stage', 'Applied')) or dashboard_stage == 'Rejected':
-                    existing.update({'stage': dashboard_stage, 'date_added': datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-                    if current_user_id:
-                        db.save_application(current_user_id, company, job, dashboard_stage)
-                    message = "Email analyzed and existing application updated"
-                else:
-                    message = "Email analyzed but no update needed"
+        action, row = apply_analysis(result)
+        if action:
+            if row and current_user_id:
+                db.save_application(current_user_id, *row)
+            message = {'added': "Email analyzed and application added automatically",
+                       'updated': "Email analyzed and existing application updated",
+                       'unchanged': "Email analyzed but no update needed"}[action]
             
             return jsonify({"message": message, "analysis": result, "added_to_dashboard": True})
         
         return jsonify({"message": "Email analyzed but not added to dashboard (low confidence or missing info)", "analysis": result, "added_to_dashboard": False})
         
-    except ImportError:
-        return jsonify({"error": "Gemini analyzer not available"}), 500
     except Exception as e:
         return jsonify({"error": f"Analysis failed: {str(e)}"}), 500
 
+@app.route("/api/analyze-emails", methods=["POST"])
+def analyze_emails():
+    """Bulk analysis of a JSON array or an uploaded mbox/EML/JSON file ('file'), streamed back as NDJSON as emails finish."""
+    from utils.mail_import import iter_json, iter_upload
+    if not (analyzer := get_analyzer()):
+        return jsonify({"error": "Gemini analyzer not available"}), 500
+    try:
+        if upload := request.files.get("file"):
+            emails = iter_upload(upload)
+        elif isinstance(data := request.get_json(silent=True), list):
+            emails = iter_json(data)
+        else:
+            return jsonify({"error": "Send a JSON array of emails or upload an mbox/EML file as 'file'"}), 400
+    except ValueError as e:
+        return jsonify({"error": f"Unreadable upload: {e}"}), 400
+
+    def results(future, counts):
+        chunk, analyzed = future.result()
+        rows, lines = {}, []
+        for email in chunk:
+            result = analyzed.get(email['id']) or {'error': 'missing from analysis'}
+            action, row = apply_analysis(result)
+            if row:
+                rows[normalize_key(row[0], row[1])] = row
+            counts['failed' if 'error' in result else action or 'ignored'] += 1
+            lines.append(json.dumps({"id": email['id'], "subject": email['subject'], "analysis": result, "action": action}) + "\n")
+        # Persisted before anything is yielded: a client disconnecting mid-stream can't leave the store ahead of the DB
+        if rows and current_user_id:
+            db.save_applications_batch(current_user_id, list(rows.values()))
+            counts['saved'] += len(rows)
+        return lines
+
+    def stream():
+        counts, pending = {'added': 0, 'updated': 0, 'unchanged': 0, 'ignored': 0, 'failed': 0, 'saved': 0}, set()
+        pool = ThreadPoolExecutor(max_workers=ANALYZE_WORKERS)
+        try:
+            try:
+                # Read ahead only a couple of chunks per worker so a large mailbox isn't held in memory
+                while chunk := list(islice(emails, ANALYZE_CHUNK_SIZE)):
+                    pending.add(pool.submit(lambda c: (c, analyzer.analyze_emails(c)), chunk))
+                    if len(pending) >= ANALYZE_WORKERS * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from results(future, counts)
+            except ValueError as e:
+                yield json.dumps({"error": f"Stopped reading upload: {e}"}) + "\n"
+            for future in wait(pending).done:
+                yield from results(future, counts)
+            yield json.dumps({"done": True, **counts}) + "\n"
+        finally:
+            # On disconnect, chunks not yet analyzed are dropped from both the store and the DB alike
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "healthy"})
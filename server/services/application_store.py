@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+STAGES = ['Applied', 'Interview', 'Offer', 'Rejected']
+# Analyzer interview_stage -> board stage; anything else lands in Applied
+STAGE_MAPPING = {
+    'application_received': 'Applied', 'phone_screen': 'Interview', 'technical_interview': 'Interview',
+    'behavioral_interview': 'Interview', 'final_interview': 'Interview', 'offer': 'Offer', 'rejected': 'Rejected'
+}
+CHANGE_LOG_SIZE = int(os.getenv('APPLICATION_CHANGE_LOG_SIZE', 1000))
+
+
+def normalize_key(company, position):
+    return (company.strip().casefold(), position.strip().casefold())
+
+
+class ApplicationStore:
+    """In-memory applications indexed by id and by normalized (company, position), guarded by one lock.
+
+    Every mutation bumps `version` and is appended to a bounded change log, so clients can ask for
+    just the changes since the version they last saw. `on_change(version, op, application)` is called
+    for each change ('insert', 'update', 'delete', or 'reload' with no application) while the lock is held.
+    """
+
+    def __init__(self, on_change=None):
+        self._by_id = {}
+        self._by_key = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+        # Seeded from the clock so versions keep increasing across server restarts
+        self.version = time.time_ns() // 1_000_000
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._log_start = self.version
+        self.on_change = on_change
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def load(self, applications):
+        with self._lock:
+            self._by_id.clear()
+            self._by_key.clear()
+            for app in applications:
+                self._index(dict(app))
+            self._next_id = max(self._by_id, default=0) + 1
+            # A reload replaces everything; older versions can't be diffed against it
+            self.version += 1
+            self._changes.clear()
+            self._log_start = self.version
+            if self.on_change:
+                self.on_change(self.version, 'reload', None)
+
+    def _record(self, op, app):
+        self.version += 1
+        if len(self._changes) == self._changes.maxlen:
+            self._log_start = self._changes[0][0]
+        self._changes.append((self.version, op, dict(app)))
+        if self.on_change:
+            self.on_change(self.version, op, dict(app))
+
+    def _index(self, app):
+        self._by_id[app['id']] = app
+        self._by_key[normalize_key(app['company'], app['position'])] = app
+
+    def all(self):
+        with self._lock:
+            return [dict(app) for app in self._by_id.values()]
+
+    def grouped(self):
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        """(version, applications grouped by stage), taken atomically."""
+        grouped = {stage: [] for stage in STAGES}
+        with self._lock:
+            version, apps = self.version, self.all()
+        for app in apps:
+            if (stage := app.get('stage', 'Applied')) in grouped:
+                grouped[stage].append(app)
+        return version, grouped
+
+    def changes_since(self, since):
+        """Net changes after version `since` as (version, changes), or (version, None) when the log can't diff from it.
+
+        Each change is {'op': 'insert'|'update'|'delete', 'version', 'application'}; only the latest state of
+        each application is returned, and an insert followed by updates is still reported as an insert.
+        """
+        with self._lock:
+            # A version from the future was issued before a restart (the clock-seeded counter can go back)
+            if since < self._log_start or since > self.version:
+                return self.version, None
+            latest = {}
+            for version, op, app in self._changes:
+                if version <= since:
+                    continue
+                if op == 'update' and latest.get(app['id'], {}).get('op') == 'insert':
+                    op = 'insert'
+                latest.pop(app['id'], None)
+                latest[app['id']] = {'op': op, 'version': version, 'application': app}
+            return self.version, list(latest.values())
+
+    def get(self, app_id):
+        with self._lock:
+            return dict(app) if (app := self._by_id.get(app_id)) else None
+
+    def find(self, company, position):
+        with self._lock:
+            return dict(app) if (app := self._by_key.get(normalize_key(company, position))) else None
+
+    def upsert(self, company, position, stage, advance_only=False):
+        """Insert or update by (company, position); returns (application, action) where action is 'added', 'updated' or 'unchanged'.
+
+        With advance_only, an existing application only moves forward through STAGES (or to Rejected).
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            if not (existing := self._by_key.get(normalize_key(company, position))):
+                app = {"id": self._next_id, "company": company, "position": position, "stage": stage, "date_added": now}
+                self._next_id += 1
+                self._index(app)
+                self._record('insert', app)
+                return dict(app), 'added'
+
+            if advance_only and not (STAGES.index(stage) > STAGES.index(existing.get('stage', 'Applied')) or stage == 'Rejected'):
+                return dict(existing), 'unchanged'
+            existing.update({"stage": stage, "date_added": now})
+            self._record('update', existing)
+            return dict(existing), 'updated'
+
+    def update_stage(self, app_id, stage):
+        with self._lock:
+            if not (app := self._by_id.get(app_id)):
+                return None
+            app.update({"stage": stage, "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+            self._record('update', app)
+            return dict(app)
+
+    def delete(self, app_id):
+        with self._lock:
+            if not (app := self._by_id.pop(app_id, None)):
+                return None
+            self._by_key.pop(normalize_key(app['company'], app['position']), None)
+            self._record('delete', app)
+            return app
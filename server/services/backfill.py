@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from datetime import datetime
+from utils import db
+from utils.rate_limiter import CircuitOpenError
+from .email_service import KEYWORD_QUERY
+
+BACKFILL_MONTHS = int(os.getenv('BACKFILL_MONTHS', 24))
+WINDOW_DAYS = int(os.getenv('BACKFILL_WINDOW_DAYS', 30))
+PAGE_SIZE = int(os.getenv('BACKFILL_PAGE_SIZE', 100))
+# The job waits while more emails than this are parked for retry
+MAX_PARKED = int(os.getenv('BACKFILL_MAX_PARKED', 100))
+DAY = 86400
+
+
+class BackfillJob:
+    """Walks a user's mailbox backwards in date windows, feeding matching mail through the monitor's pipeline.
+
+    The position (current window and page token) is checkpointed in the DB only once every message of a page
+    has left the pipeline, so a restarted job resumes where it stopped without skipping unprocessed mail.
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.user_id = None
+        self.state = None
+        self.error = None
+        self.thread = None
+        self._stop = threading.Event()
+        self._session = None
+        self._saved = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, months=None, restart=False):
+        # Parked ids are only released by the monitor loop's polls; without it a checkpoint could wait forever
+        if self.is_running() or not self.monitor.is_running or not self.monitor.analyzer or not self.monitor.user_id or not self.monitor.email_service.is_authenticated():
+            return False
+        self.user_id = self.monitor.user_id
+        now = int(time.time())
+        oldest = now - (months or BACKFILL_MONTHS) * 30 * DAY
+        state = None if restart else db.get_backfill_state(self.user_id)
+        if state is None:
+            state = {'status': 'running', 'newest': now, 'oldest': oldest, 'window_end': now, 'page_token': None,
+                     'messages_seen': 0, 'messages_submitted': 0}
+        elif months and oldest < state['oldest']:
+            # Extend a finished or partial job further back; everything newer is already covered
+            state['oldest'] = oldest
+        elif state['status'] == 'done':
+            self.state = state
+            return False
+        state['status'] = 'running'
+
+        self.state, self.error, self._saved = state, None, dict(state)
+        self._session = (time.monotonic(), state['newest'] - state['window_end'])
+        db.save_backfill_state(self.user_id, state)
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print(f"📚 Backfill started back to {datetime.fromtimestamp(state['oldest']).date()}")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self.is_running():
+            self.thread.join(timeout=5)
+
+    def _can_analyze(self):
+        return self.monitor.analyzer.is_available() and len(self.monitor.email_service.retry_queue) < MAX_PARKED
+
+    def _run(self):
+        # A separate connection: the monitor loop keeps polling on the shared one meanwhile
+        gmail, pipeline, state = self.monitor.email_service.clone(), self.monitor.pipeline, self.state
+        pending = None
+        try:
+            while not self._stop.is_set() and state['window_end'] > state['oldest']:
+                if not self._can_analyze():
+                    # Gemini is degraded: running ahead would only park (and eventually drop) everything fetched
+                    self._stop.wait(30)
+                    continue
+                window_start = max(state['oldest'], state['window_end'] - WINDOW_DAYS * DAY)
+                query = f"{KEYWORD_QUERY} after:{window_start} before:{state['window_end']}"
+                try:
+                    messages, next_token = gmail.list_message_page(query, state['page_token'], PAGE_SIZE)
+                except CircuitOpenError:
+                    self._stop.wait(30)
+                    continue
+                except Exception:
+                    if not state['page_token']:
+                        raise
+                    # Page tokens expire; restarting the window is safe since the ledger skips what's done
+                    state['page_token'] = None
+                    continue
+
+                pipeline.start()
+                ids = [m['id'] for m in messages]
+                fetched = gmail.fetch_messages(ids, exclude=pipeline.in_flight_ids(), gate=self.monitor._metadata_gate)
+                submitted = self.monitor.submit_messages(fetched)
+                state['messages_seen'] += len(ids)
+                state['messages_submitted'] += len(submitted)
+                if next_token:
+                    state['page_token'] = next_token
+                else:
+                    state['window_end'], state['page_token'] = window_start, None
+
+                # Checkpoint lags one page behind so fetching the next page overlaps with analysis of this one
+                if not self._checkpoint(pending):
+                    break
+                pending = (ids, submitted, dict(state))
+
+            if self._checkpoint(pending) and state['window_end'] <= state['oldest']:
+                state['status'] = 'done'
+            else:
+                state['status'] = 'paused'
+            print(f"📚 Backfill {state['status']}: {state['messages_submitted']} of {state['messages_seen']} messages submitted for analysis")
+        except Exception as e:
+            print(f"❌ Backfill failed: {e}")
+            self.error, state['status'] = str(e), 'failed'
+        db.save_backfill_state(self.user_id, {**self._saved, 'status': state['status']})
+        self.monitor.publish_progress(force=True)
+
+    def _checkpoint(self, pending):
+        if pending is None:
+            return True
+        ids, submitted, snapshot = pending
+        retry_queue = self.monitor.email_service.retry_queue
+        # Parked ids left the pipeline without being processed; they only count once retried or given up on
+        while not self.monitor.pipeline.wait_for(submitted, timeout=1.0) or any(i in retry_queue for i in ids):
+            if self._stop.is_set() or not self.monitor.pipeline.is_running():
+                # Stopped with messages unprocessed: keep the previous checkpoint so they're fetched again
+                return False
+            self._stop.wait(1.0)
+        db.save_backfill_state(self.user_id, snapshot)
+        self._saved = snapshot
+        self.monitor.publish_progress(force=True)
+        return True
+
+    def progress(self):
+        if not (state := self.state):
+            return None
+        span = max(1, state['newest'] - state['oldest'])
+        covered = state['newest'] - state['window_end']
+        eta = None
+        if self.is_running() and self._session:
+            started, covered_at_start = self._session
+            if (rate := (covered - covered_at_start) / max(1e-6, time.monotonic() - started)) > 0:
+                eta = round((span - covered) / rate)
+        return {
+            'status': state['status'],
+            'percent': round(100 * min(1.0, covered / span), 1),
+            'oldest': datetime.fromtimestamp(state['oldest']).date().isoformat(),
+            'current_window_end': datetime.fromtimestamp(state['window_end']).date().isoformat(),
+            'messages_seen': state['messages_seen'],
+            'messages_submitted': state['messages_submitted'],
+            'eta_seconds': eta,
+            'error': self.error,
+        }
+
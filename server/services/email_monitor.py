@@ -1,24 +1,37 @@
 import threading
 import time
-from .email_service import GmailService
+from collections import OrderedDict
+from .email_service import GmailService, KEYWORD_PATTERN
+from .ingestion_pipeline import IngestionPipeline
+from .application_store import ApplicationStore, STAGE_MAPPING
+from .write_behind import WriteBehindBuffer
+from .backfill import BackfillJob
+from .poll_scheduler import PollScheduler
+from .event_bus import get_event_bus
 import os
-from datetime import datetime
+from utils import db
+from utils.rate_limiter import breaker_states
 
 try:
-    from utils.gemini_analyzer import GeminiEmailAnalyzer
+    from utils.gemini_analyzer import GeminiEmailAnalyzer, EMPTY_RESULT
+    from utils.prefilter import RelevancePrefilter
+    from utils.simhash import NearDuplicateIndex
 except ImportError:
     GeminiEmailAnalyzer = None
 
+def is_relevant(result):
+    return result.get('confidence', 0) >= 30 and bool(result.get('company_name')) and bool(result.get('job_title'))
+
 class EmailMonitor:
     
-    def __init__(self, applications_list=None):
+    def __init__(self, application_store=None):
         self.email_service = GmailService()
         self.is_running = False
         self.monitor_thread = None
-        self.check_interval = 5
+        self.scheduler = PollScheduler()
         self.processed_emails = 0
-        self.applications = applications_list or []
-        self.app_counter_ref = None
+        self.applications = application_store if application_store is not None else ApplicationStore()
+        self.user_id = None
         self.consecutive_errors = 0
         
         self.analyzer = None
@@ -27,11 +40,32 @@ class EmailMonitor:
                 self.analyzer = GeminiEmailAnalyzer()
             except:
                 pass
+        self.prefilter = RelevancePrefilter() if self.analyzer else None
+        self.near_duplicates = NearDuplicateIndex() if self.analyzer else None
+        self.thread_applications = OrderedDict()
+        # Newest message id -> older ids of its thread, ledgered as superseded once the newest is processed
+        self.superseded = OrderedDict()
+        self._thread_lock = threading.Lock()
+
+        self.write_buffer = WriteBehindBuffer()
+        self.pipeline = IngestionPipeline(self.email_service.decode_message, self._analyze_batch, self._persist_result)
+        self.backfill = BackfillJob(self)
+        self.events = get_event_bus()
+        self._progress_published = 0.0
     
-    def set_applications_ref(self, applications_list, app_counter_ref):
-        self.applications = applications_list
-        self.app_counter_ref = app_counter_ref
+    def set_application_store(self, application_store):
+        self.applications = application_store
         
+    def set_user(self, user_id):
+        if user_id != self.user_id:
+            self.backfill.stop()
+        self.user_id = user_id
+        self.email_service.processed_emails.set_user(user_id)
+        self.scheduler.set_bounds(*(db.get_poll_bounds(user_id) if user_id else (None, None)))
+        with self._thread_lock:
+            self.thread_applications.clear()
+            self.superseded.clear()
+
     def get_auth_url(self):
         return self.email_service.get_authorization_url()
     
@@ -41,98 +75,214 @@ class EmailMonitor:
     def start_monitoring(self):
         if self.is_running or not self.email_service.is_authenticated():
             return self.is_running
-        try:
-            recent_msgs = self.email_service.list_messages(max_results=50)
-            self.email_service.processed_emails.update({m['id'] for m in recent_msgs})
-        except:
-            pass
 
         self.is_running = True
+        self.pipeline.start()
         self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self.monitor_thread.start()
         return True
     
+    def start_backfill(self, months=None, restart=False):
+        return self.backfill.start(months, restart)
+
+    def set_poll_bounds(self, min_seconds=None, max_seconds=None):
+        """Update either bound, keeping the user's stored value for one that's omitted; raises ValueError if min > max."""
+        if self.user_id:
+            stored_min, stored_max = db.get_poll_bounds(self.user_id)
+            min_seconds = stored_min if min_seconds is None else min_seconds
+            max_seconds = stored_max if max_seconds is None else max_seconds
+        if min_seconds is not None and max_seconds is not None and min_seconds > max_seconds:
+            raise ValueError("min_seconds cannot exceed max_seconds")
+        if self.user_id:
+            db.save_poll_bounds(self.user_id, min_seconds, max_seconds)
+        self.scheduler.set_bounds(min_seconds, max_seconds)
+        self.scheduler.wake()
+
     def stop_monitoring(self):
         self.is_running = False
+        self.scheduler.wake()
+        self.backfill.stop()
         if self.monitor_thread and self.monitor_thread.is_alive():
             self.monitor_thread.join(timeout=2)
+        # The history delta has moved past anything still in flight; park it so the next start fetches it again
+        for message_id in self.pipeline.stop():
+            self.email_service.retry_queue.park(message_id)
+        self.write_buffer.flush()
     
     def _monitor_loop(self):
         while self.is_running:
             try:
-                self._check_emails()
+                self.scheduler.record_poll_start()
+                self.scheduler.record_poll(self._check_emails())
                 self.consecutive_errors = 0
-                time.sleep(self.check_interval)
+                self.scheduler.wait()
                 
             except Exception as e:
                 self.consecutive_errors += 1
+                self.scheduler.record_poll(0)
                 wait_time = min(60, 10 * (2 ** min(self.consecutive_errors - 1, 3)))
-                time.sleep(wait_time)
+                self.scheduler.wait(wait_time)
     
     def _check_emails(self):
-        emails = self.email_service.get_recent_emails(max_results=10)
-        for email in emails:
-            if not self.is_running:
-                break
-            self._process_email(email)
-            self.processed_emails += 1
-    
-    def _process_email(self, email):
+        # Fetch stage: the rest of the work happens on the pipeline's decode/analysis/persist threads
+        self.pipeline.start()
+        # Parked emails stay parked while the analyzer's circuit is open; re-fetching them would only fail again
+        release_parked = self.analyzer is None or self.analyzer.is_available()
+        messages = self.email_service.fetch_new_messages(max_results=10, exclude=self.pipeline.in_flight_ids(), gate=self._metadata_gate,
+                                                         release_parked=release_parked)
+        return len(self.submit_messages(messages))
+
+    def submit_messages(self, messages):
+        """Queue fetched (message, needs_keyword_check) pairs for analysis; returns the ids submitted."""
+        # Only the newest message of each thread is analyzed; it reflects the conversation's current stage
+        newest = {}
+        for message, needs_keyword_check in messages:
+            thread_id = message.get('threadId') or message['id']
+            if thread_id not in newest or int(message.get('internalDate', 0)) > int(newest[thread_id][0].get('internalDate', 0)):
+                newest[thread_id] = (message, needs_keyword_check)
+        older = {}
+        for message, _ in messages:
+            if (latest := newest[message.get('threadId') or message['id']][0]) is not message:
+                older.setdefault(latest['id'], []).append(message['id'])
+        with self._thread_lock:
+            for message_id, ids in older.items():
+                self.superseded.setdefault(message_id, []).extend(ids)
+            while len(self.superseded) > 5000:
+                self.superseded.popitem(last=False)
+
+        submitted = []
+        for message, needs_keyword_check in newest.values():
+            # Replies in a tracked thread are relevant whatever they say ("Thanks, see you Tuesday")
+            if needs_keyword_check and self._thread_application(message.get('threadId')) is not None:
+                needs_keyword_check = False
+            if self.pipeline.submit(message, needs_keyword_check):
+                submitted.append(message['id'])
+        return submitted
+
+    def _metadata_gate(self, metadata):
+        """Cheap relevance check on headers + snippet deciding whether a message is worth a full fetch."""
+        if not self.prefilter or KEYWORD_PATTERN.search(f"{metadata['subject']} {metadata['snippet']}"):
+            return True
+        if self._thread_application(metadata['thread_id']) is not None:
+            return True
+        return not self.prefilter.should_skip({'subject': metadata['subject'], 'body': metadata['snippet'], 'sender': metadata['sender']})
+
+    def _thread_application(self, thread_id):
+        if not thread_id:
+            return None
+        with self._thread_lock:
+            if thread_id in self.thread_applications:
+                self.thread_applications.move_to_end(thread_id)
+                return self.thread_applications[thread_id]
+        if known := (db.get_thread_application(self.user_id, thread_id) if self.user_id else None):
+            self._remember_thread(thread_id, *known, persist=False)
+        return known
+
+    def _remember_thread(self, thread_id, company, position, persist=True):
+        with self._thread_lock:
+            self.thread_applications[thread_id] = (company, position)
+            self.thread_applications.move_to_end(thread_id)
+            while len(self.thread_applications) > 5000:
+                self.thread_applications.popitem(last=False)
+        if persist and self.user_id:
+            try:
+                db.save_thread_application(self.user_id, thread_id, company, position)
+            except Exception as e:
+                print(f"❌ Failed to save thread application: {e}")
+
+    def _analyze_batch(self, emails):
         if not self.analyzer:
+            return {}
+        results, to_analyze, threaded = {}, [], []
+        for email in emails:
+            if (known := self._thread_application(email.get('thread_id'))) is not None:
+                threaded.append((email, known))
+            elif self.prefilter.should_skip(email):
+                results[email['id']] = {**EMPTY_RESULT, 'prefiltered': True}
+            elif (reused := self.near_duplicates.lookup(email)) is not None:
+                results[email['id']] = {**reused, 'near_duplicate': True}
+                if is_relevant(reused) and email.get('thread_id'):
+                    self._remember_thread(email['thread_id'], reused['company_name'], reused['job_title'])
+            else:
+                to_analyze.append(email)
+
+        # Threads with a known company/position only need the cheaper stage-only prompt
+        stages = self.analyzer.classify_stages([email for email, _ in threaded]) if threaded else {}
+        for email, (company, position) in threaded:
+            if 'error' in (stage := stages.get(email['id'], {'error': 'missing'})):
+                to_analyze.append(email)
+                continue
+            results[email['id']] = {'company_name': company, 'job_title': position, 'interview_stage': stage['interview_stage'],
+                                    'confidence': stage['confidence'], 'thread_context': True}
+
+        analyzed = self.analyzer.analyze_emails(to_analyze) if to_analyze else {}
+        for email in to_analyze:
+            if (result := analyzed.get(email['id'])) is not None and 'error' not in result:
+                self.prefilter.learn(email, is_relevant(result))
+                self.near_duplicates.add(email, result)
+                if is_relevant(result) and email.get('thread_id'):
+                    self._remember_thread(email['thread_id'], result['company_name'], result['job_title'])
+        results.update(analyzed)
+        return results
+
+    def _persist_result(self, email, result):
+        retry_queue = self.email_service.retry_queue
+        if (result is None and self.analyzer) or (result is not None and 'error' in result):
+            # Analysis failed or raised (quota, outage, bad reply): park the email rather than recording it as processed
+            if not retry_queue.park(email['id']):
+                print(f"❌ Giving up on email after repeated analysis failures: {email['subject'][:50]}...")
+                self.email_service.processed_emails.add(email['id'], 'failed')
+            return
+        if (status := self._process_email(email, result)) is not None:
+            self.email_service.processed_emails.add(email['id'], status)
+            retry_queue.discard(email['id'])
+            with self._thread_lock:
+                older = self.superseded.pop(email['id'], [])
+            for message_id in older:
+                self.email_service.processed_emails.add(message_id, 'superseded')
+        self.processed_emails += 1
+        self.publish_progress()
+
+    def publish_progress(self, force=False):
+        # At most two progress events a second; a backfill can persist far more emails than that
+        if not force and time.monotonic() - self._progress_published < 0.5:
             return
+        self._progress_published = time.monotonic()
+        self.events.publish('progress', {'processed_emails': self.processed_emails, 'in_flight': len(self.pipeline.in_flight),
+                                         'backfill': self.backfill.progress()})
+    
+    def _process_email(self, email, result):
+        # Without an analyzer nothing ran; leave the email out of the ledger
+        if not self.analyzer or result is None:
+            return None
         
         try:
-            result = self.analyzer.analyze_email_for_interview_stage(
-                email['subject'], email['body'], email.get('sender', '')
-            )
-            
-            stage_mapping = {
-                'application_received': 'Applied', 'phone_screen': 'Interview',
-                'technical_interview': 'Interview', 'behavioral_interview': 'Interview',
-                'final_interview': 'Interview', 'offer': 'Offer', 'rejected': 'Rejected'
-            }
-            
-            if result.get('confidence', 0) >= 30 and result.get('company_name') and result.get('job_title'):
+            if result.get('prefiltered'):
+                print(f"⏭️ Skipped email (local prefilter): {email['subject'][:50]}...")
+                return 'prefiltered'
+            if is_relevant(result):
                 self._add_or_update_application(
                     result['company_name'], 
                     result['job_title'], 
-                    stage_mapping.get(result.get('interview_stage'), 'Applied')
+                    STAGE_MAPPING.get(result.get('interview_stage'), 'Applied')
                 )
                 print(f"✅ Added/Updated application from email: {email['subject'][:50]}...")
+                # A recruiter is active; poll at the fastest cadence for a while
+                self.scheduler.record_relevant()
             else:
-                print(f"📧 Analyzed email: {email['subject'][:50]}... (not added - confidence: {confidence}%)")
+                print(f"📧 Analyzed email: {email['subject'][:50]}... (not added - confidence: {result.get('confidence', 0)}%)")
+            return 'processed'
         except Exception as e:
             print(f"❌ Error processing email: {e}")
+            return 'failed'
     
     def _add_or_update_application(self, company, position, stage):
         try:
-            existing = next((app for app in self.applications if 
-                           app["company"].lower() == company.lower() and 
-                           app["position"].lower() == position.lower()), None)
-            
-            if existing:
-                stage_order = ['Applied', 'Interview', 'Offer', 'Rejected']
-                if stage_order.index(stage) > stage_order.index(existing.get('stage', 'Applied')) or stage == 'Rejected':
-                    existing['stage'] = stage
-                    existing['date_added'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                app_id = self.app_counter_ref[0] if self.app_counter_ref else len(self.applications) + 1
-                if self.app_counter_ref:
-                    self.app_counter_ref[0] += 1
-                
-                self.applications.append({
-                    "id": app_id, "company": company, "position": position,
-                    "stage": stage, "date_added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
+            _, action = self.applications.upsert(company, position, stage, advance_only=True)
 
-            # Persist to DB (if user available)
-            try:
-                from server import app
-                from utils import db
-                if app.current_user_id:
-                    db.save_application(app.current_user_id, company, position, stage)
-            except:
-                pass
+            # Persist to DB (if user available); the buffer batches writes into one transaction
+            if self.user_id and action != 'unchanged':
+                self.write_buffer.add(self.user_id, company, position, stage)
         except:
             pass
     
@@ -140,7 +290,16 @@ class EmailMonitor:
         if not self.email_service.is_authenticated():
             return False
         try:
-            self._check_emails()
+            if self.is_running and self.monitor_thread and self.monitor_thread.is_alive():
+                # Wake the monitor loop instead of polling Gmail from a second thread
+                target = self.scheduler.next_poll()
+                self.scheduler.wake()
+                if not self.scheduler.wait_for_poll(target, timeout=30):
+                    return False
+            else:
+                self._check_emails()
+            self.pipeline.wait_idle(timeout=60)
+            self.write_buffer.flush()
             return True
         except:
             return False
@@ -152,7 +311,16 @@ class EmailMonitor:
             'email_email': self.email_service.get_user_email(),
             'gemini_available': self.analyzer is not None,
             'processed_emails': self.processed_emails,
-            'check_interval': self.check_interval
+            'check_interval': self.scheduler.next_interval(),
+            'polling': self.scheduler.stats(),
+            'pipeline': self.pipeline.stats(),
+            'prefilter': self.prefilter.stats() if self.prefilter else None,
+            'near_duplicates': self.near_duplicates.stats() if self.near_duplicates else None,
+            'analysis_cache': self.analyzer.cache.stats() if self.analyzer else None,
+            'token_usage': self.analyzer.get_usage() if self.analyzer else None,
+            'circuits': breaker_states(),
+            'retry_queue': self.email_service.retry_queue.stats(),
+            'backfill': self.backfill.progress()
         }
 
 _monitor_instance = None
@@ -160,9 +328,7 @@ _monitor_instance = None
 def get_monitor():
     return _monitor_instance
 
-def initialize_monitor(applications_list=None, app_counter_ref=None):
+def initialize_monitor(application_store=None):
     global _monitor_instance
-    _monitor_instance = EmailMonitor(applications_list)
-    if applications_list is not None and app_counter_ref is not None:
-        _monitor_instance.set_applications_ref(applications_list, app_counter_ref)
+    _monitor_instance = EmailMonitor(application_store)
     return _monitor_instance 
\ No newline at end of file
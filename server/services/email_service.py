@@ -1,19 +1,39 @@
+import copy
 import os
-import base64
 import re
+import time
 from datetime import datetime
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
+from .processed_ledger import ProcessedLedger
+from utils.mime_text import extract_text
+from utils.rate_limiter import CircuitOpenError, RetryQueue, backoff_delay, call_with_retry, get_breaker, gmail_limiter, is_retryable
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+BATCH_SIZE = 100  # Gmail's per-batch request limit
+BATCH_RETRIES = 3
+
+KEYWORDS = ['interview', 'application', 'position', 'role', 'candidate', 'hiring', 'recruitment', 'job', 'career', 'opportunity', 'hr', 'human resources', 'talent', 'recruiter']
+KEYWORD_QUERY = '(' + ' OR '.join(f'"{k}"' for k in KEYWORDS) + ')'
+# Local equivalent of KEYWORD_QUERY for history deltas, which the API can't filter by query
+KEYWORD_PATTERN = re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in KEYWORDS) + r')\b', re.IGNORECASE)
+SKIP_LABELS = {'SENT', 'DRAFT', 'SPAM', 'TRASH'}
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+# Quota units per call (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {'messages.get': 5, 'messages.list': 5, 'history.list': 2, 'getProfile': 1}
 
 class GmailService:
     def __init__(self, user_id=None, access_token=None, refresh_token=None, token_expiry=None):
         self.user_id = user_id
         self.service = None
-        self.processed_emails = set()
+        self.processed_emails = ProcessedLedger(user_id)
+        self.history_id = None
+        # Ids that couldn't be fetched or analyzed while an API was degraded; released again with backoff
+        self.retry_queue = RetryQueue()
+        self.breaker = get_breaker('gmail')
         
         self.client_id = os.getenv('GMAIL_CLIENT_ID')
         self.client_secret = os.getenv('GMAIL_CLIENT_SECRET')
@@ -78,6 +98,11 @@ class GmailService:
         except Exception as e:
             return False, str(e)
 
+    def _execute(self, request, units):
+        """Execute an API request under the per-user quota limiter, retrying transient failures."""
+        limiter = gmail_limiter(self.user_id or self.processed_emails.user_id)
+        return call_with_retry(request.execute, breaker=self.breaker, limiter=limiter, tokens=units)
+
     def is_authenticated(self):
         return self.service is not None
 
@@ -85,26 +110,114 @@ class GmailService:
         if not self.service:
             return None
         try:
-            return self.service.users().getProfile(userId='me').execute()['emailAddress']
+            return self._execute(self.service.users().getProfile(userId='me'), QUOTA_UNITS['getProfile'])['emailAddress']
         except:
             return None
 
+    def clone(self):
+        """Same account, ledger and retry queue on its own HTTP connection, for use from another thread."""
+        other = copy.copy(self)
+        other.service = build('gmail', 'v1', credentials=self.credentials) if self.credentials else None
+        return other
+
     def list_messages(self, query='is:unread', max_results=10):
         if not self.service:
             return []
+        messages, page_token = [], None
         try:
-            return self.service.users().messages().list(userId='me', q=query, maxResults=max_results).execute().get('messages', [])
+            while len(messages) < max_results:
+                page, page_token = self.list_message_page(query, page_token, min(500, max_results - len(messages)))
+                messages.extend(page)
+                if not page_token:
+                    break
+            return messages
         except:
-            return []
+            return messages
+
+    def list_message_page(self, query, page_token=None, page_size=500):
+        """One page of messages.list results as (messages, next_page_token); errors propagate."""
+        request = self.service.users().messages().list(userId='me', q=query, maxResults=page_size, pageToken=page_token)
+        response = self._execute(request, QUOTA_UNITS['messages.list'])
+        return response.get('messages', []), response.get('nextPageToken')
 
     def get_message(self, msg_id):
         if not self.service:
             return None
         try:
-            return self.service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+            return self._execute(self.service.users().messages().get(userId='me', id=msg_id, format='full'), QUOTA_UNITS['messages.get'])
         except:
             return None
 
+    def get_messages(self, msg_ids, format='full'):
+        """Fetch messages with batched HTTP requests (up to 100 per call), retrying only the throttled ids.
+
+        Returns (messages by id, ids that failed permanently). Permanent failures (deleted messages, bad ids)
+        are recorded in the ledger as 'missing' so they're neither retried nor parked.
+        """
+        if not self.service:
+            return {}, []
+        messages, missing, pending = {}, [], list(dict.fromkeys(msg_ids))
+        for attempt in range(BATCH_RETRIES):
+            throttled = []
+            for i in range(0, len(pending), BATCH_SIZE):
+                throttled.extend(self._execute_batch(pending[i:i + BATCH_SIZE], format, messages, missing))
+            if not (pending := throttled) or attempt == BATCH_RETRIES - 1 or not self.breaker.allow():
+                break
+            time.sleep(backoff_delay(attempt))
+        if pending:
+            print(f"❌ Failed to fetch {len(pending)} messages after {attempt + 1} attempts")
+        for msg_id in missing:
+            self.processed_emails.add(msg_id, 'missing')
+            self.retry_queue.discard(msg_id)
+        return messages, missing
+
+    def _execute_batch(self, msg_ids, format, messages, missing):
+        """Run one batch request; returns the ids worth retrying and appends permanent failures to `missing`."""
+        throttled = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                messages[request_id] = response
+            elif is_retryable(exception):
+                throttled.append(request_id)
+            else:
+                missing.append(request_id)
+
+        if not self.breaker.allow():
+            return list(msg_ids)
+        # Every request inside a batch is billed against the quota individually
+        gmail_limiter(self.user_id or self.processed_emails.user_id).acquire(QUOTA_UNITS['messages.get'] * len(msg_ids))
+        try:
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id in msg_ids:
+                extra = {'metadataHeaders': METADATA_HEADERS} if format == 'metadata' else {}
+                batch.add(self.service.users().messages().get(userId='me', id=msg_id, format=format, **extra), request_id=msg_id)
+            batch.execute()
+        except Exception as e:
+            if not is_retryable(e):
+                # The whole request was rejected (e.g. expired credentials); retrying now won't help, but the API
+                # answered, so a half-open trial must still be resolved
+                self.breaker.record_success()
+                return []
+            self.breaker.record_failure()
+            return [m for m in msg_ids if m not in messages]
+        if throttled and len(throttled) == len(msg_ids):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return throttled
+
+    def extract_metadata(self, message):
+        headers = {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
+        return {
+            'id': message['id'],
+            'thread_id': message.get('threadId'),
+            'subject': headers.get('Subject', 'No Subject'),
+            'sender': headers.get('From', 'Unknown Sender'),
+            'date': headers.get('Date', ''),
+            'snippet': message.get('snippet', '')
+        }
+
     def extract_email_details(self, message):
         try:
             headers = {h['name']: h['value'] for h in message['payload'].get('headers', [])}
@@ -121,48 +234,109 @@ class GmailService:
 
     def _extract_body_content(self, payload):
         try:
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                        return self._decode_base64(part['body']['data'])[:1000]
-                    elif part['mimeType'] == 'text/html' and 'data' in part['body']:
-                        return re.sub('<[^<]+?>', '', self._decode_base64(part['body']['data']))[:1000]
-            elif 'body' in payload and 'data' in payload['body']:
-                content = self._decode_base64(payload['body']['data'])
-                if payload['mimeType'] == 'text/html':
-                    content = re.sub('<[^<]+?>', '', content)
-                return content[:1000]
-            return ""
-        except:
-            return ""
-
-    def _decode_base64(self, data):
-        try:
-            return base64.urlsafe_b64decode(data).decode('utf-8')
+            return extract_text(payload, limit=1000)
         except:
             return ""
 
     def get_recent_emails(self, max_results=50):
+        return [email for message, check in self.fetch_new_messages(max_results) if (email := self.decode_message(message, check))]
+
+    def fetch_new_messages(self, max_results=50, exclude=(), gate=None, release_parked=True):
+        """Raw messages not yet in the ledger, as (message, needs_keyword_check) pairs.
+
+        With a gate, messages are first fetched as metadata (Subject/From/Date headers plus snippet) and
+        only those the gate accepts are fetched in full; rejected ones are recorded in the ledger as 'gated'.
+        Ids that can't be fetched are parked in the retry queue; due parked ids are included unless
+        release_parked is False (e.g. while the analyzer is degraded).
+        """
         if not self.service:
             return []
         try:
-            keywords = ['interview', 'application', 'position', 'role', 'candidate', 'hiring', 'recruitment', 'job', 'career', 'opportunity', 'hr', 'human resources', 'talent', 'recruiter']
-            query = f"({' OR '.join([f'\"{k}\"' for k in keywords])}) AND newer_than:7d"
-            
-            messages = self.list_messages(query=query, max_results=max_results)
-            emails = []
-            
-            for message in messages:
-                if message['id'] not in self.processed_emails:
-                    full_message = self.get_message(message['id'])
-                    if full_message:
-                        emails.append(self.extract_email_details(full_message))
-                        self.processed_emails.add(message['id'])
-            
-            return emails
+            is_delta = self.history_id is not None and (message_ids := self._get_history_message_ids()) is not None
+            if not is_delta:
+                message_ids = self._get_full_sync_message_ids(max_results)
+            if release_parked and (parked := self.retry_queue.due()):
+                message_ids = list(dict.fromkeys(message_ids + parked))
+            return self.fetch_messages(message_ids, exclude, gate, needs_keyword_check=is_delta)
         except:
             return []
 
+    def fetch_messages(self, message_ids, exclude=(), gate=None, needs_keyword_check=False):
+        """Full messages for the given ids that aren't in the ledger, through the metadata gate; unfetchable ids are parked."""
+        # Relevant emails are recorded in the ledger by the monitor once they've actually been processed
+        unprocessed = set(self.processed_emails.filter_unprocessed(message_ids))
+        for msg_id in message_ids:
+            if msg_id not in unprocessed:
+                self.retry_queue.discard(msg_id)
+        new_ids = [m for m in dict.fromkeys(message_ids) if m in unprocessed and m not in exclude]
+        if gate:
+            new_ids = self._apply_metadata_gate(new_ids, gate)
+        fetched, missing = self.get_messages(new_ids)
+        for msg_id in new_ids:
+            if msg_id not in fetched and msg_id not in missing:
+                self.retry_queue.park(msg_id)
+        return [(fetched[m], needs_keyword_check) for m in new_ids if m in fetched]
+
+    def _apply_metadata_gate(self, msg_ids, gate):
+        (metadata, missing), passed = self.get_messages(msg_ids, format='metadata'), []
+        for msg_id in msg_ids:
+            if (message := metadata.get(msg_id)) is None:
+                if msg_id not in missing:
+                    self.retry_queue.park(msg_id)
+                continue
+            if gate(self.extract_metadata(message)):
+                passed.append(msg_id)
+            else:
+                self.processed_emails.add(msg_id, 'gated')
+                self.retry_queue.discard(msg_id)
+        return passed
+
+    def decode_message(self, message, needs_keyword_check=False):
+        email = self.extract_email_details(message)
+        if needs_keyword_check and not KEYWORD_PATTERN.search(f"{email['subject']} {email['body']}"):
+            self.processed_emails.add(email['id'], 'skipped')
+            return None
+        return email
+
+    def _get_full_sync_message_ids(self, max_results):
+        # Take the history id before listing so nothing arriving in between is missed
+        try:
+            self.history_id = self._execute(self.service.users().getProfile(userId='me'), QUOTA_UNITS['getProfile']).get('historyId')
+        except:
+            self.history_id = None
+        return [m['id'] for m in self.list_messages(query=f"{KEYWORD_QUERY} AND newer_than:7d", max_results=max_results)]
+
+    def _get_history_message_ids(self):
+        """Ids of messages added since self.history_id, or None when a full sync is needed."""
+        message_ids, page_token, latest_history_id = [], None, self.history_id
+        try:
+            while True:
+                response = self._execute(self.service.users().history().list(
+                    userId='me', startHistoryId=self.history_id, historyTypes=['messageAdded'], pageToken=page_token
+                ), QUOTA_UNITS['history.list'])
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added.get('message', {})
+                        if not SKIP_LABELS.intersection(message.get('labelIds', [])):
+                            message_ids.append(message['id'])
+                latest_history_id = response.get('historyId', latest_history_id)
+                if not (page_token := response.get('nextPageToken')):
+                    break
+        except HttpError as e:
+            if e.resp.status == 404:
+                print("⚠️ Gmail history id expired, falling back to full sync")
+            if is_retryable(e):
+                return []
+            self.history_id = None
+            return None
+        except CircuitOpenError:
+            # Keep the history position; the delta is picked up once Gmail recovers
+            return []
+        except:
+            return None
+        self.history_id = latest_history_id
+        return list(dict.fromkeys(message_ids))
+
     def get_credentials_dict(self):
         if not self.credentials:
             return None
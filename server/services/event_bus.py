@@ -0,0 +1,77 @@
+import itertools
+import json
+import threading
+from collections import deque
+
+SUBSCRIBER_BUFFER_SIZE = 256
+
+
+class Subscription:
+    """One listener's bounded event buffer; on overflow the oldest events are dropped and `lagged` is set."""
+
+    def __init__(self, bus, buffer_size):
+        self.bus = bus
+        self.events = deque(maxlen=buffer_size)
+        self.lagged = False
+        self._ready = threading.Condition()
+
+    def push(self, event):
+        with self._ready:
+            if len(self.events) == self.events.maxlen:
+                self.lagged = True
+            self.events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Next event, or None on timeout. A lagging subscriber gets a single 'resync' event first."""
+        with self._ready:
+            if not self._ready.wait_for(lambda: self.events or self.lagged, timeout):
+                return None
+            if self.lagged:
+                self.lagged = False
+                self.events.clear()
+                return {'id': None, 'type': 'resync', 'data': {}}
+            return self.events.popleft()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """In-process pub/sub for server-sent events; publishing never blocks on slow subscribers."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self, buffer_size=SUBSCRIBER_BUFFER_SIZE):
+        subscription = Subscription(self, buffer_size)
+        with self._lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+
+def format_sse(event):
+    lines = [f"event: {event['type']}", f"data: {json.dumps(event['data'], separators=(',', ':'))}"]
+    if event['id'] is not None:
+        lines.insert(0, f"id: {event['id']}")
+    return '\n'.join(lines) + '\n\n'
+
+
+_bus = EventBus()
+
+
+def get_event_bus():
+    return _bus
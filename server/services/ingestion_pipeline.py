@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+
+
+class IngestionPipeline:
+    """Decode -> analyze -> persist stages fed by the monitor's fetch loop and joined by bounded queues.
+
+    Full queues block the stage feeding them, so a slow analyzer throttles fetching instead of buffering
+    the whole inbox in memory. Analysis runs on a worker pool; persistence stays on a single thread.
+    """
+
+    def __init__(self, decode, analyze, persist, decode_workers=None, analysis_workers=None, batch_size=None, queue_size=None):
+        self.decode = decode
+        self.analyze = analyze
+        self.persist = persist
+        self.decode_workers = decode_workers or int(os.getenv('PIPELINE_DECODE_WORKERS', 2))
+        self.analysis_workers = analysis_workers or int(os.getenv('PIPELINE_ANALYSIS_WORKERS', 4))
+        self.batch_size = batch_size or int(os.getenv('PIPELINE_ANALYSIS_BATCH_SIZE', 10))
+        self.queue_size = queue_size or int(os.getenv('PIPELINE_QUEUE_SIZE', 100))
+
+        self.decode_queue = queue.Queue(maxsize=self.queue_size)
+        self.analysis_queue = queue.Queue(maxsize=self.queue_size)
+        self.persist_queue = queue.Queue(maxsize=self.queue_size)
+        self.in_flight = set()
+        self._idle = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.is_running():
+            return
+        # Each run gets its own stop event and queues: workers of a stopped run still finishing a slow Gemini
+        # call exit on their own event and can't pick up (or race over) the new run's items
+        self._stop = stop = threading.Event()
+        self.decode_queue, self.analysis_queue, self.persist_queue = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+        stages = [(self._decode_stage, (stop, self.decode_queue, self.analysis_queue))] * self.decode_workers
+        stages += [(self._analysis_stage, (stop, self.analysis_queue, self.persist_queue))] * self.analysis_workers
+        stages += [(self._persist_stage, (stop, self.persist_queue))]
+        self._threads = [threading.Thread(target=stage, args=args, daemon=True) for stage, args in stages]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the workers; returns the ids that were still in flight and never reached persist."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        for q in (self.decode_queue, self.analysis_queue, self.persist_queue):
+            while not q.empty():
+                q.get_nowait()
+        with self._idle:
+            dropped, self.in_flight = self.in_flight, set()
+            self._idle.notify_all()
+        return dropped
+
+    def is_running(self):
+        return bool(self._threads) and not self._stop.is_set()
+
+    def submit(self, message, needs_keyword_check=False):
+        with self._idle:
+            if message['id'] in self.in_flight:
+                return False
+            self.in_flight.add(message['id'])
+        stop = self._stop
+        if not self._put(self.decode_queue, (message, needs_keyword_check), stop):
+            self._done(message['id'], stop)
+            return False
+        return True
+
+    def in_flight_ids(self):
+        with self._idle:
+            return set(self.in_flight)
+
+    def wait_idle(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.in_flight, timeout)
+
+    def wait_for(self, message_ids, timeout=None):
+        """Block until none of message_ids is in flight any more."""
+        message_ids = set(message_ids)
+        with self._idle:
+            return self._idle.wait_for(lambda: not message_ids & self.in_flight, timeout)
+
+    def stats(self):
+        return {
+            'in_flight': len(self.in_flight),
+            'decode_queue': self.decode_queue.qsize(),
+            'analysis_queue': self.analysis_queue.qsize(),
+            'persist_queue': self.persist_queue.qsize(),
+            'decode_workers': self.decode_workers,
+            'analysis_workers': self.analysis_workers,
+        }
+
+    def _put(self, q, item, stop):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def _done(self, message_id, stop):
+        with self._idle:
+            if stop.is_set():
+                # A stopping or stopped run; stop() hands its in-flight ids back to the caller
+                return
+            self.in_flight.discard(message_id)
+            self._idle.notify_all()
+
+    def _decode_stage(self, stop, source, sink):
+        while not stop.is_set():
+            if (item := self._get(source)) is None:
+                continue
+            message, needs_keyword_check = item
+            try:
+                email = self.decode(message, needs_keyword_check)
+            except Exception as e:
+                print(f"❌ Error decoding email {message.get('id')}: {e}")
+                email = None
+            if email is None or not self._put(sink, email, stop):
+                self._done(message['id'], stop)
+
+    def _analysis_stage(self, stop, source, sink):
+        while not stop.is_set():
+            if (email := self._get(source)) is None:
+                continue
+            batch = [email]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(source.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.analyze(batch)
+            except Exception as e:
+                print(f"❌ Batch analysis failed: {e}")
+                results = {}
+            for email in batch:
+                if not self._put(sink, (email, results.get(email['id'])), stop):
+                    self._done(email['id'], stop)
+
+    def _persist_stage(self, stop, source):
+        while not stop.is_set():
+            if (item := self._get(source)) is None:
+                continue
+            email, result = item
+            try:
+                self.persist(email, result)
+            except Exception as e:
+                print(f"❌ Error persisting email {email.get('id')}: {e}")
+            finally:
+                self._done(email['id'], stop)
@@ -0,0 +1,101 @@
+import os
+import threading
+from datetime import datetime
+
+MIN_INTERVAL = float(os.getenv('POLL_MIN_SECONDS', 10))
+MAX_INTERVAL = float(os.getenv('POLL_MAX_SECONDS', 300))
+BACKOFF_FACTOR = float(os.getenv('POLL_BACKOFF_FACTOR', 1.5))
+# Local hours (start-end, may wrap midnight) during which the monitor polls at its maximum interval
+OFF_HOURS = os.getenv('POLL_OFF_HOURS', '22-7')
+
+
+def _parse_hours(spec):
+    try:
+        start, end = (int(h) % 24 for h in spec.split('-'))
+        return start, end
+    except:
+        return None
+
+
+class PollScheduler:
+    """Adaptive delay between inbox polls.
+
+    Relevant mail drops the interval to the minimum; every poll that finds nothing new stretches it by
+    BACKOFF_FACTOR up to the maximum, and off-hours always use the maximum. wake() cuts the current wait short.
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, off_hours=OFF_HOURS):
+        self.off_hours = _parse_hours(off_hours) if off_hours else None
+        self.set_bounds(min_interval, max_interval)
+        self.polls = 0
+        self.started_polls = 0
+        self.idle_polls = 0
+        self.wakeups = 0
+        self._wake = threading.Event()
+        self._polled = threading.Condition()
+
+    def set_bounds(self, min_interval=None, max_interval=None):
+        self.min_interval = max(1.0, float(min_interval or MIN_INTERVAL))
+        self.max_interval = max(self.min_interval, float(max_interval or MAX_INTERVAL))
+        self.interval = self.min_interval
+
+    def is_off_hours(self, now=None):
+        if not self.off_hours:
+            return False
+        start, end = self.off_hours
+        hour = (now or datetime.now()).hour
+        return start <= hour < end if start < end else hour >= start or hour < end
+
+    def next_interval(self):
+        return self.max_interval if self.is_off_hours() else self.interval
+
+    def record_poll_start(self):
+        with self._polled:
+            self.started_polls += 1
+
+    def record_poll(self, new_messages):
+        if new_messages:
+            self.idle_polls = 0
+        else:
+            self.idle_polls += 1
+            self.interval = min(self.max_interval, self.interval * BACKOFF_FACTOR)
+        with self._polled:
+            self.polls += 1
+            self._polled.notify_all()
+
+    def record_relevant(self):
+        self.interval = self.min_interval
+
+    def wait(self, seconds=None):
+        """Sleep until the next poll is due or wake() is called; returns True when woken early."""
+        woken = self._wake.wait(self.next_interval() if seconds is None else seconds)
+        self._wake.clear()
+        return woken
+
+    def wake(self):
+        self.wakeups += 1
+        self.interval = self.min_interval
+        self._wake.set()
+
+    def next_poll(self):
+        """Number of the next poll to start; take it before wake() so that poll can't be missed."""
+        with self._polled:
+            return self.started_polls + 1
+
+    def wait_for_poll(self, target=None, timeout=None):
+        """Block until poll number `target` (by default the next one to start) has completed."""
+        with self._polled:
+            # Polls run one at a time, so they complete in the order they started
+            target = target or self.started_polls + 1
+            return self._polled.wait_for(lambda: self.polls >= target, timeout)
+
+    def stats(self):
+        return {
+            'interval': round(self.next_interval(), 1),
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'off_hours': self.is_off_hours(),
+            'idle_polls': self.idle_polls,
+            'polls': self.polls,
+            'wakeups': self.wakeups,
+        }
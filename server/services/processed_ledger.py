@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+from utils import db
+
+
+class ProcessedLedger:
+    """Set-like view of the processed_messages table with a bounded in-memory tier of recent ids."""
+
+    def __init__(self, user_id=None, capacity=10000):
+        self.user_id = user_id
+        self.capacity = capacity
+        self.recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_user(self, user_id):
+        with self._lock:
+            if user_id != self.user_id:
+                self.user_id = user_id
+                self.recent.clear()
+
+    def _remember(self, message_id, status):
+        self.recent[message_id] = status
+        self.recent.move_to_end(message_id)
+        while len(self.recent) > self.capacity:
+            self.recent.popitem(last=False)
+
+    def __contains__(self, message_id):
+        return not self.filter_unprocessed([message_id])
+
+    def __len__(self):
+        return len(self.recent)
+
+    def filter_unprocessed(self, message_ids):
+        with self._lock:
+            unknown = [m for m in message_ids if m not in self.recent]
+            found = db.get_processed_message_ids(self.user_id, unknown) if unknown and self.user_id is not None else set()
+            for message_id in found:
+                self._remember(message_id, 'processed')
+            return [m for m in unknown if m not in found]
+
+    def add(self, message_id, status='processed'):
+        with self._lock:
+            self._remember(message_id, status)
+            user_id = self.user_id
+        if user_id is not None:
+            try:
+                db.mark_message_processed(user_id, message_id, status)
+            except Exception as e:
+                print(f"❌ Failed to record processed message {message_id}: {e}")
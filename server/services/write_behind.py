@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from utils import db
+
+
+class WriteBehindBuffer:
+    """Coalesces application upserts per user and writes them with db.save_applications_batch.
+
+    Flushes once max_rows rows are pending or max_delay_ms after the oldest pending row, whichever
+    comes first. Later rows for the same (company, position) replace earlier ones before they're written.
+    """
+
+    def __init__(self, max_rows=None, max_delay_ms=None):
+        self.max_rows = max_rows or int(os.getenv('DB_WRITE_BATCH_ROWS', 50))
+        self.max_delay = (max_delay_ms or int(os.getenv('DB_WRITE_BATCH_MS', 500))) / 1000
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._has_rows = threading.Event()
+        self._thread = None
+
+    def add(self, user_id, company, position, stage):
+        with self._lock:
+            rows = self._pending.setdefault(user_id, {})
+            key = (db.normalize_key(company), db.normalize_key(position))
+            if key not in rows:
+                self._size += 1
+            rows[key] = (company, position, stage)
+            full = self._size >= self.max_rows
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+                self._thread.start()
+        self._has_rows.set()
+        if full:
+            self.flush()
+
+    def discard(self, user_id, company, position):
+        """Drop a pending row, waiting out any flush that may already be writing it."""
+        with self._flush_lock, self._lock:
+            if self._pending.get(user_id, {}).pop((db.normalize_key(company), db.normalize_key(position)), None):
+                self._size -= 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._size = self._pending, {}, 0
+                self._has_rows.clear()
+            for user_id, rows in pending.items():
+                try:
+                    db.save_applications_batch(user_id, rows.values())
+                except Exception as e:
+                    print(f"❌ Failed to write {len(rows)} applications: {e}")
+                    self._requeue(user_id, rows)
+
+    def _requeue(self, user_id, rows):
+        with self._lock:
+            current = self._pending.setdefault(user_id, {})
+            for key, row in rows.items():
+                if key not in current:
+                    current[key] = row
+                    self._size += 1
+        self._has_rows.set()
+
+    def _flush_loop(self):
+        while True:
+            self._has_rows.wait()
+            time.sleep(self.max_delay)
+            self.flush()
@@ -0,0 +1,95 @@
+import sqlite3, os, json, time, hashlib, threading
+from collections import OrderedDict
+
+# Lives next to applyst.db so restarts keep paying nothing for already-analyzed mail
+_CACHE_PATH = os.getenv('APPLYST_CACHE_PATH', os.path.join(os.path.dirname(__file__), '..', '..', 'applyst_cache.db'))
+
+
+class AnalysisCache:
+    """Two-tier (in-memory LRU + SQLite) cache of analyzer results keyed by content hash."""
+
+    def __init__(self, path=_CACHE_PATH, memory_size=2048, max_rows=50000, max_age_days=90):
+        self.memory = OrderedDict()
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.max_age = max_age_days * 86400
+        self.hits = self.misses = self.disk_hits = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS analysis_cache (key TEXT PRIMARY KEY, result TEXT, created_at REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_created ON analysis_cache(created_at)')
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(subject, body, sender, prompt_version, model_name):
+        raw = '\x1f'.join(str(p or '') for p in (subject, body, sender, prompt_version, model_name))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self.memory:
+                result, created_at = self.memory[key]
+                if time.time() - created_at > self.max_age:
+                    # The disk copy has the same age, so it's just as stale
+                    del self.memory[key]
+                    self.misses += 1
+                    return None
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return dict(result)
+            row = self.conn.execute('SELECT result, created_at FROM analysis_cache WHERE key = ?', (key,)).fetchone()
+            if not row or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            result = json.loads(row[0])
+            self._remember(key, result, row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return dict(result)
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, dict(result), created_at := time.time())
+            self.conn.execute('INSERT OR REPLACE INTO analysis_cache (key, result, created_at) VALUES (?, ?, ?)',
+                              (key, json.dumps(result), created_at))
+            self.conn.commit()
+            self._writes += 1
+            run_eviction = self._writes % 500 == 0
+        if run_eviction:
+            self.evict()
+
+    def _remember(self, key, result, created_at):
+        self.memory[key] = (result, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM analysis_cache WHERE created_at < ?', (time.time() - self.max_age,))
+            self.conn.execute('''DELETE FROM analysis_cache WHERE key IN (
+                SELECT key FROM analysis_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)''', (self.max_rows,))
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'memory_entries': len(self.memory),
+        }
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = AnalysisCache()
+        return _cache_instance
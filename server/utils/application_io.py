@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+FIELDS = ['company', 'position', 'stage', 'date_added']
+FORMATS = ('csv', 'jsonl')
+
+
+def export_lines(applications, fmt):
+    """CSV or JSONL text for an iterable of application dicts, one line at a time."""
+    if fmt == 'jsonl':
+        for app in applications:
+            yield json.dumps({field: app.get(field) for field in FIELDS}, ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for app in applications:
+        writer.writerow(app)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _validate(record, stages):
+    """Normalized (company, position, stage, date_added) from an imported record; raises ValueError with the reason."""
+    if not isinstance(record, dict):
+        raise ValueError('expected an object')
+    company, position = (str(record.get(f) or '').strip() for f in ('company', 'position'))
+    if not company or not position:
+        raise ValueError('company and position are required')
+    if (stage := str(record.get('stage') or 'Applied').strip()) not in stages:
+        raise ValueError(f"unknown stage '{stage}'")
+    date_added = None
+    if value := str(record.get('date_added') or '').strip():
+        try:
+            date_added = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            raise ValueError(f"invalid date_added '{value}'")
+    return company, position, stage, date_added
+
+
+def iter_import_rows(stream, fmt, stages):
+    """Parse an uploaded byte stream incrementally, yielding (row number, row tuple or None, error or None)."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        # Row numbers count the header as row 1, matching what a spreadsheet shows
+        reader = csv.DictReader(text)
+        records = ((reader.line_num, record) for record in reader)
+    else:
+        records = ((number, line) for number, line in enumerate(text, 1) if line.strip())
+
+    for number, record in records:
+        try:
+            if fmt == 'jsonl':
+                record = json.loads(record)
+            yield number, _validate(record, stages), None
+        except ValueError as e:
+            yield number, None, str(e)
@@ -1,59 +1,320 @@
-import sqlite3, os
-from datetime import datetime
-
-# Single connection shared across the backend
-_DB_PATH = os.getenv('APPLYST_DB_PATH', os.path.join(os.path.dirname(__file__), '..', '..', 'applyst.db'))
-conn = sqlite3.connect(_DB_PATH, check_same_thread=False)
-cursor = conn.cursor()
-
-cursor.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, created_at TEXT)')
-cursor.execute('''CREATE TABLE IF NOT EXISTS applications (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    company TEXT,
-    position TEXT,
-    stage TEXT,
-    date_added TEXT,
-    UNIQUE(user_id, company, position)
-)''')
-conn.commit()
-
-
-def ensure_user(email: str) -> int:
-    cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-    row = cursor.fetchone()
-    if row:
-        return row[0]
-    cursor.execute('INSERT INTO users (email, created_at) VALUES (?, ?)', (email, datetime.now().isoformat()))
-    conn.commit()
-    print(f"✅ New user {email} added to DB")
-    return cursor.lastrowid
-
-
-def get_user_applications(user_id: int):
-    cursor.execute('SELECT id, company, position, stage, date_added FROM applications WHERE user_id = ?', (user_id,))
-    return [
-        {"id": r[0], "company": r[1], "position": r[2], "stage": r[3], "date_added": r[4]}
-        for r in cursor.fetchall()
-    ]
-
-
-def save_application(user_id: int, company: str, position: str, stage: str):
-    cursor.execute(
-        'SELECT id, stage FROM applications WHERE user_id = ? AND lower(company) = lower(?) AND lower(position) = lower(?)',
-        (user_id, company, position),
-    )
-    row = cursor.fetchone()
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    if row:
-        if stage != row[1]:
-            cursor.execute('UPDATE applications SET stage = ?, date_added = ? WHERE id = ?', (stage, now, row[0]))
-            conn.commit()
-    else:
-        cursor.execute(
-            'INSERT INTO applications (user_id, company, position, stage, date_added) VALUES (?, ?, ?, ?, ?)',
-            (user_id, company, position, stage, now),
-        )
-        conn.commit()
-        print('✅ New application saved to DB') 
\ No newline at end of file
+import sqlite3, os, queue, threading, json, base64
+from contextlib import contextmanager
+from datetime import datetime
+
+# One serialized writer connection plus a pool of reader connections; under WAL readers never block on the writer
+_DB_PATH = os.getenv('APPLYST_DB_PATH', os.path.join(os.path.dirname(__file__), '..', '..', 'applyst.db'))
+_READ_POOL_SIZE = int(os.getenv('APPLYST_DB_READ_POOL_SIZE', 8))
+
+
+def _connect():
+    conn = sqlite3.connect(_DB_PATH, check_same_thread=False, timeout=10)
+    # WAL lets Flask request threads read while the monitor writes; NORMAL sync is durable under WAL
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-16000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA busy_timeout=10000')
+    return conn
+
+
+_writer = _connect()
+_write_lock = threading.Lock()
+_readers = queue.LifoQueue(maxsize=_READ_POOL_SIZE)
+
+
+@contextmanager
+def _transaction():
+    """Cursor on the single writer connection; commits on success, rolls back on error."""
+    with _write_lock, _writer:
+        yield _writer.cursor()
+
+
+@contextmanager
+def _read():
+    try:
+        conn = _readers.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn.cursor()
+    finally:
+        try:
+            _readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def normalize_key(text: str) -> str:
+    return text.strip().casefold()
+
+
+def _init_schema():
+    with _transaction() as cursor:
+        cursor.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, created_at TEXT)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS applications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            company TEXT,
+            position TEXT,
+            stage TEXT,
+            date_added TEXT,
+            UNIQUE(user_id, company, position)
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS processed_messages (
+            user_id INTEGER,
+            message_id TEXT,
+            status TEXT,
+            processed_at TEXT,
+            PRIMARY KEY(user_id, message_id)
+        )''')
+        cursor.execute('CREATE TABLE IF NOT EXISTS model_state (name TEXT PRIMARY KEY, state TEXT, updated_at TEXT)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS thread_applications (
+            user_id INTEGER,
+            thread_id TEXT,
+            company TEXT,
+            position TEXT,
+            updated_at TEXT,
+            PRIMARY KEY(user_id, thread_id)
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS backfill_state (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT,
+            newest INTEGER,
+            oldest INTEGER,
+            window_end INTEGER,
+            page_token TEXT,
+            messages_seen INTEGER,
+            messages_submitted INTEGER,
+            updated_at TEXT
+        )''')
+        _migrate(cursor)
+
+
+def _migrate(cursor):
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version < 1:
+        # Normalized (company, position) key columns so the case-insensitive lookup can use a unique index
+        columns = {r[1] for r in cursor.execute('PRAGMA table_info(applications)')}
+        if 'company_key' not in columns:
+            cursor.execute('ALTER TABLE applications ADD COLUMN company_key TEXT')
+            cursor.execute('ALTER TABLE applications ADD COLUMN position_key TEXT')
+        latest, duplicates = {}, []
+        for app_id, user_id, company, position in cursor.execute('SELECT id, user_id, company, position FROM applications ORDER BY id').fetchall():
+            key = (user_id, normalize_key(company or ''), normalize_key(position or ''))
+            if key in latest:
+                duplicates.append(latest[key])
+            latest[key] = app_id
+        cursor.executemany('DELETE FROM applications WHERE id = ?', [(d,) for d in duplicates])
+        cursor.executemany('UPDATE applications SET company_key = ?, position_key = ? WHERE id = ?',
+                           [(k[1], k[2], app_id) for k, app_id in latest.items()])
+        # Leading user_id column also serves get_user_applications
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_applications_user_key ON applications(user_id, company_key, position_key)')
+        cursor.execute('PRAGMA user_version = 1')
+    if version < 2:
+        # Per-user polling bounds; NULL falls back to the POLL_MIN_SECONDS/POLL_MAX_SECONDS defaults
+        columns = {r[1] for r in cursor.execute('PRAGMA table_info(users)')}
+        if 'poll_min_seconds' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN poll_min_seconds REAL')
+            cursor.execute('ALTER TABLE users ADD COLUMN poll_max_seconds REAL')
+        cursor.execute('PRAGMA user_version = 2')
+    if version < 3:
+        # Keyset pagination indexes for query_applications; (user_id, company_key, ...) already covers company sorts
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_user_date ON applications(user_id, date_added, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_user_stage_date ON applications(user_id, stage, date_added, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_user_position ON applications(user_id, position_key, id)')
+        cursor.execute('PRAGMA user_version = 3')
+
+
+_init_schema()
+
+
+def ensure_user(email: str) -> int:
+    with _read() as cursor:
+        if row := cursor.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone():
+            return row[0]
+    with _transaction() as cursor:
+        cursor.execute('INSERT OR IGNORE INTO users (email, created_at) VALUES (?, ?)', (email, datetime.now().isoformat()))
+        user_id = cursor.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()[0]
+    print(f"✅ New user {email} added to DB")
+    return user_id
+
+
+def get_poll_bounds(user_id: int):
+    with _read() as cursor:
+        row = cursor.execute('SELECT poll_min_seconds, poll_max_seconds FROM users WHERE id = ?', (user_id,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+
+def save_poll_bounds(user_id: int, min_seconds, max_seconds):
+    with _transaction() as cursor:
+        cursor.execute('UPDATE users SET poll_min_seconds = ?, poll_max_seconds = ? WHERE id = ?', (min_seconds, max_seconds, user_id))
+
+
+def get_user_applications(user_id: int):
+    with _read() as cursor:
+        cursor.execute('SELECT id, company, position, stage, date_added FROM applications WHERE user_id = ?', (user_id,))
+        return [
+            {"id": r[0], "company": r[1], "position": r[2], "stage": r[3], "date_added": r[4]}
+            for r in cursor.fetchall()
+        ]
+
+
+def iter_applications(user_id: int, batch_size: int = 500):
+    """Stream a user's applications in id order straight off a reader cursor, batch_size rows at a time."""
+    with _read() as cursor:
+        cursor.execute('SELECT id, company, position, stage, date_added FROM applications WHERE user_id = ? ORDER BY id', (user_id,))
+        while rows := cursor.fetchmany(batch_size):
+            for r in rows:
+                yield {"id": r[0], "company": r[1], "position": r[2], "stage": r[3], "date_added": r[4]}
+
+
+# Sort name -> column; keys are the casefolded columns so ordering matches the case-insensitive uniqueness
+_SORT_COLUMNS = {'date_added': 'date_added', 'company': 'company_key', 'position': 'position_key'}
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(sort, value, app_id):
+    return base64.urlsafe_b64encode(json.dumps([sort, value, app_id]).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sort):
+    try:
+        cursor_sort, value, app_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if cursor_sort != sort:
+        raise ValueError('cursor belongs to a different sort order')
+    return value, app_id
+
+
+def query_applications(user_id: int, stages=None, text=None, date_from=None, date_to=None, sort='-date_added', limit=50, cursor=None):
+    """One page of a user's applications, filtered and keyset-paginated in SQL; returns (applications, next_cursor).
+
+    sort is a _SORT_COLUMNS name, optionally prefixed with '-' for descending. Dates compare as the stored
+    'YYYY-MM-DD HH:MM:SS' text, so a bare date_to covers that whole day. Raises ValueError on bad arguments.
+    """
+    descending = sort.startswith('-')
+    if (column := _SORT_COLUMNS.get(sort[1:] if descending else sort)) is None:
+        raise ValueError(f"sort must be one of {', '.join(_SORT_COLUMNS)} (optionally prefixed with '-')")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    where, params = ['user_id = ?'], [user_id]
+    if stages:
+        where.append(f"stage IN ({', '.join('?' * len(stages))})")
+        params.extend(stages)
+    if text:
+        where.append('(instr(company_key, ?) > 0 OR instr(position_key, ?) > 0)')
+        params.extend([normalize_key(text)] * 2)
+    if date_from:
+        where.append('date_added >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('date_added <= ?')
+        params.append(date_to + ' 23:59:59' if len(date_to) == 10 else date_to)
+    if cursor:
+        value, app_id = _decode_cursor(cursor, sort)
+        where.append(f"({column}, id) {'<' if descending else '>'} (?, ?)")
+        params.extend([value, app_id])
+
+    order = 'DESC' if descending else 'ASC'
+    with _read() as cur:
+        rows = cur.execute(f'''SELECT id, company, position, stage, date_added, {column} FROM applications
+            WHERE {' AND '.join(where)} ORDER BY {column} {order}, id {order} LIMIT ?''', (*params, limit + 1)).fetchall()
+
+    next_cursor = _encode_cursor(sort, rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+    return [{"id": r[0], "company": r[1], "position": r[2], "stage": r[3], "date_added": r[4]} for r in rows[:limit]], next_cursor
+
+
+_UPSERT_APPLICATION = '''INSERT INTO applications (user_id, company, position, stage, date_added, company_key, position_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, company_key, position_key) DO UPDATE SET stage = excluded.stage, date_added = excluded.date_added
+    WHERE applications.stage != excluded.stage'''
+
+
+def _application_params(user_id, company, position, stage, now):
+    return (user_id, company, position, stage, now, normalize_key(company), normalize_key(position))
+
+
+def save_application(user_id: int, company: str, position: str, stage: str):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _transaction() as cursor:
+        cursor.execute(_UPSERT_APPLICATION, _application_params(user_id, company, position, stage, now))
+
+
+def save_applications_batch(user_id: int, rows):
+    """Upsert many (company, position, stage[, date_added]) rows in a single transaction."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _transaction() as cursor:
+        cursor.executemany(_UPSERT_APPLICATION, (_application_params(user_id, c, p, s, d[0] if d and d[0] else now) for c, p, s, *d in rows))
+
+
+def delete_application(user_id: int, company: str, position: str):
+    # By key rather than id: in-memory ids aren't guaranteed to match the autoincrement ids in the DB
+    with _transaction() as cursor:
+        cursor.execute('DELETE FROM applications WHERE user_id = ? AND company_key = ? AND position_key = ?',
+                       (user_id, normalize_key(company), normalize_key(position)))
+
+
+def mark_message_processed(user_id: int, message_id: str, status: str = 'processed'):
+    with _transaction() as cursor:
+        cursor.execute(
+            'INSERT OR REPLACE INTO processed_messages (user_id, message_id, status, processed_at) VALUES (?, ?, ?, ?)',
+            (user_id, message_id, status, datetime.now().isoformat()),
+        )
+
+
+def get_processed_message_ids(user_id: int, message_ids):
+    message_ids = list(message_ids)
+    found = set()
+    with _read() as cursor:
+        for i in range(0, len(message_ids), 500):
+            chunk = message_ids[i:i + 500]
+            cursor.execute(
+                f'SELECT message_id FROM processed_messages WHERE user_id = ? AND message_id IN ({",".join("?" * len(chunk))})',
+                (user_id, *chunk),
+            )
+            found.update(r[0] for r in cursor.fetchall())
+    return found
+
+
+def get_model_state(name: str):
+    with _read() as cursor:
+        row = cursor.execute('SELECT state FROM model_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+
+def save_model_state(name: str, state: str):
+    with _transaction() as cursor:
+        cursor.execute('INSERT OR REPLACE INTO model_state (name, state, updated_at) VALUES (?, ?, ?)',
+                       (name, state, datetime.now().isoformat()))
+
+
+def get_thread_application(user_id: int, thread_id: str):
+    with _read() as cursor:
+        row = cursor.execute('SELECT company, position FROM thread_applications WHERE user_id = ? AND thread_id = ?',
+                             (user_id, thread_id)).fetchone()
+        return tuple(row) if row else None
+
+
+def save_thread_application(user_id: int, thread_id: str, company: str, position: str):
+    with _transaction() as cursor:
+        cursor.execute('INSERT OR REPLACE INTO thread_applications (user_id, thread_id, company, position, updated_at) VALUES (?, ?, ?, ?, ?)',
+                       (user_id, thread_id, company, position, datetime.now().isoformat()))
+
+
+# newest/oldest/window_end are epoch seconds; the job walks window_end back from newest to oldest
+_BACKFILL_FIELDS = ('status', 'newest', 'oldest', 'window_end', 'page_token', 'messages_seen', 'messages_submitted', 'updated_at')
+
+
+def get_backfill_state(user_id: int):
+    with _read() as cursor:
+        row = cursor.execute(f'SELECT {", ".join(_BACKFILL_FIELDS)} FROM backfill_state WHERE user_id = ?', (user_id,)).fetchone()
+        return dict(zip(_BACKFILL_FIELDS, row)) if row else None
+
+
+def save_backfill_state(user_id: int, state: dict):
+    state = {**state, 'updated_at': datetime.now().isoformat()}
+    with _transaction() as cursor:
+        cursor.execute(f'INSERT OR REPLACE INTO backfill_state (user_id, {", ".join(_BACKFILL_FIELDS)}) VALUES (?{", ?" * len(_BACKFILL_FIELDS)})',
+                       (user_id, *(state.get(f) for f in _BACKFILL_FIELDS)))
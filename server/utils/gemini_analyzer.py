@@ -1,73 +1,243 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-load_dotenv()
-
-class GeminiEmailAnalyzer:
-    
-    def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key or api_key.strip() == '' or api_key.strip() == "''":
-            raise ValueError("❌ GEMINI_API_KEY environment variable is required and cannot be empty. Please set it in the .env file.")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    def analyze_email_for_interview_stage(self, subject, body, sender_email=""):
-        prompt = f"""
-        Analyze this email and extract job application information:
-        
-        Subject: {subject}
-        Body: {body}
-        Sender: {sender_email}
-        
-        Extract the following information:
-        1. Company name
-        2. Job title/position
-        3. Interview stage (choose from: application_received, phone_screen, technical_interview, 
-           behavioral_interview, final_interview, offer, rejected, other)
-        4. Confidence level (0-100) based on how certain you are
-        
-        Return the response in this exact JSON format:
-        {{
-            "company_name": "extracted company name or null",
-            "job_title": "extracted job title or null", 
-            "interview_stage": "stage or null",
-            "confidence": confidence_score
-        }}
-        
-        Only return the JSON, no other text.
-        """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
-            
-            import json
-            import re
-            
-            json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', result_text, re.DOTALL)
-            if json_match:
-                result_text = json_match.group(1).strip()
-            
-            result = json.loads(result_text)
-            
-            def clean_value(value):
-                return None if value in [None, 'null', ''] else (value.strip() if isinstance(value, str) else value)
-            
-            return {
-                'company_name': clean_value(result.get('company_name')),
-                'job_title': clean_value(result.get('job_title')),
-                'interview_stage': clean_value(result.get('interview_stage')),
-                'confidence': int(result.get('confidence', 0))
-            }
-            
-        except Exception as e:
-            print(f"❌ Gemini analysis error: {e}")
-            return {
-                'company_name': None,
-                'job_title': None,
-                'interview_stage': None,
-                'confidence': 0
-            }
+import os
+import json
+import re
+import threading
+import time
+from collections import deque
+import google.generativeai as genai
+from dotenv import load_dotenv
+from utils.analysis_cache import get_cache
+from utils.rate_limiter import CircuitOpenError, call_with_retry, gemini_limiter, get_breaker, is_retryable
+from utils.prompt_builder import estimate_tokens, estimate_email_tokens, analysis_prompt, batch_analysis_prompt, stage_prompt
+
+load_dotenv()
+
+# Prompt budget per batched call, counted on compacted email bodies
+BATCH_TOKEN_BUDGET = int(os.getenv('GEMINI_BATCH_TOKEN_BUDGET', 8000))
+MAX_BATCH_SIZE = int(os.getenv('GEMINI_MAX_BATCH_SIZE', 20))
+# Bump whenever the prompts or result shape change so stale cached analyses are ignored
+PROMPT_VERSION = 'v2'
+STAGE_PROMPT_VERSION = 'stage-v2'
+
+# Cheapest/fastest model first; an email moves to the next tier only when the previous answer is unsure
+MODEL_CASCADE = [m.strip() for m in os.getenv('GEMINI_MODEL_CASCADE', 'gemini-1.5-flash,gemini-1.5-pro').split(',') if m.strip()]
+ESCALATION_CONFIDENCE = int(os.getenv('GEMINI_ESCALATION_CONFIDENCE', 60))
+# USD per 1M (input, output) tokens, for the cost counters only
+MODEL_PRICES = {
+    'gemini-1.5-flash-8b': (0.0375, 0.15),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+}
+
+EMPTY_RESULT = {'company_name': None, 'job_title': None, 'interview_stage': None, 'confidence': 0}
+
+
+def needs_escalation(result):
+    """A job-related answer that is low-confidence or missing company/title; plainly irrelevant mail is never escalated."""
+    if 'error' in result:
+        return False
+    job_signal = result.get('interview_stage') not in (None, 'other') or result.get('company_name') or result.get('job_title')
+    return bool(job_signal) and (result.get('confidence', 0) < ESCALATION_CONFIDENCE or not (result.get('company_name') and result.get('job_title')))
+
+
+def _better(previous, current):
+    if previous is None or 'error' in previous:
+        return current
+    if 'error' in current:
+        return previous
+    return current if current.get('confidence', 0) >= previous.get('confidence', 0) else previous
+
+
+class GeminiEmailAnalyzer:
+
+    def __init__(self):
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key or api_key.strip() == '' or api_key.strip() == "''":
+            raise ValueError("❌ GEMINI_API_KEY environment variable is required and cannot be empty. Please set it in the .env file.")
+
+        genai.configure(api_key=api_key)
+        self.tiers = [{'name': name, 'model': genai.GenerativeModel(name), 'breaker': get_breaker(f'gemini:{name}'), 'calls': 0, 'emails': 0, 'escalated_in': 0,
+                       'input_tokens': 0, 'output_tokens': 0, 'latency_ms': 0.0, 'cost_usd': 0.0} for name in MODEL_CASCADE]
+        # Cached results depend on the whole cascade, not just the first model
+        self.model_name = ','.join(MODEL_CASCADE)
+        self.cache = get_cache()
+        self.recent_calls = deque(maxlen=100)
+        self._usage_lock = threading.Lock()
+
+    def is_available(self):
+        """False while the first tier's circuit is open; every analysis would fail fast until it recovers."""
+        return self.tiers[0]['breaker'].state != 'open'
+
+    def _cache_key(self, subject, body, sender_email):
+        return self.cache.make_key(subject, body, sender_email, PROMPT_VERSION, self.model_name)
+
+    def _email_key(self, email):
+        return self._cache_key(email['subject'], email['body'], email.get('sender', ''))
+
+    def analyze_email_for_interview_stage(self, subject, body, sender_email=""):
+        return self.analyze_emails([{'id': 'single', 'subject': subject, 'body': body, 'sender': sender_email}])['single']
+
+    def analyze_emails(self, batch):
+        """Analyze many emails through the model cascade, one call per token-budgeted chunk per tier; returns {email id: result}."""
+        results, pending = {}, []
+        for email in batch:
+            if (cached := self.cache.get(self._email_key(email))) is not None:
+                results[email['id']] = cached
+            else:
+                pending.append(email)
+        analyzed = list(pending)
+
+        for tier in range(len(self.tiers)):
+            if not pending:
+                break
+            if tier:
+                with self._usage_lock:
+                    self.tiers[tier]['escalated_in'] += len(pending)
+            tier_results = self._analyze_with_tier(pending, tier)
+            for email in pending:
+                results[email['id']] = _better(results.get(email['id']), tier_results[email['id']])
+            pending = [e for e in pending if needs_escalation(results[e['id']])]
+
+        for email in analyzed:
+            if 'error' not in (result := results[email['id']]):
+                self.cache.put(self._email_key(email), result)
+        return results
+
+    def _analyze_with_tier(self, emails, tier):
+        results = {}
+        for chunk in self._split_batch(emails):
+            if len(chunk) > 1:
+                results.update(self._analyze_chunk(chunk, tier))
+                continue
+            results[chunk[0]['id']] = self._analyze_single(chunk[0], tier)
+        return results
+
+    def _analyze_single(self, email, tier):
+        try:
+            response = self._generate(analysis_prompt(email['subject'], email['body'], email.get('sender', '')), tier, 1)
+            return self._clean_result(self._parse_json(response.text))
+        except Exception as e:
+            print(f"❌ Gemini analysis error ({self.tiers[tier]['name']}): {e}")
+            return {**EMPTY_RESULT, 'error': str(e)}
+
+    def _analyze_chunk(self, chunk, tier):
+        try:
+            response = self._generate(batch_analysis_prompt(chunk), tier, len(chunk))
+            parsed = self._parse_json(response.text)
+            results = {str(item.get('id')): self._clean_result(item) for item in parsed if isinstance(item, dict)}
+        except Exception as e:
+            print(f"❌ Gemini batch analysis error ({self.tiers[tier]['name']}): {e}")
+            if isinstance(e, CircuitOpenError) or is_retryable(e):
+                # Quota/availability problem: one call per email would only make it worse
+                return {email['id']: {**EMPTY_RESULT, 'error': str(e)} for email in chunk}
+            results = {}
+
+        # Anything the model dropped or mangled gets a single-email retry
+        return {e['id']: results.get(str(e['id'])) or self._analyze_single(e, tier) for e in chunk}
+
+    def _generate(self, prompt, tier=0, emails=1):
+        tier_stats, timing = self.tiers[tier], {}
+
+        def call():
+            # Timed per attempt so limiter waits and backoff sleeps don't count as model latency
+            timing['started'] = time.perf_counter()
+            return tier_stats['model'].generate_content(prompt)
+
+        response = call_with_retry(call, breaker=tier_stats['breaker'], limiter=gemini_limiter(tier_stats['name']))
+        latency_ms = (time.perf_counter() - timing['started']) * 1000
+        usage = getattr(response, 'usage_metadata', None)
+        input_tokens = getattr(usage, 'prompt_token_count', None) or estimate_tokens(prompt)
+        output_tokens = getattr(usage, 'candidates_token_count', None) or 0
+        input_price, output_price = MODEL_PRICES.get(tier_stats['name'], (0.0, 0.0))
+        with self._usage_lock:
+            tier_stats['calls'] += 1
+            tier_stats['emails'] += emails
+            tier_stats['input_tokens'] += input_tokens
+            tier_stats['output_tokens'] += output_tokens
+            tier_stats['latency_ms'] += latency_ms
+            tier_stats['cost_usd'] += (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+            self.recent_calls.append({'model': tier_stats['name'], 'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                                      'latency_ms': round(latency_ms, 1)})
+        return response
+
+    def get_usage(self):
+        with self._usage_lock:
+            tiers = [{k: (round(v, 4) if isinstance(v, float) else v) for k, v in t.items() if k not in ('model', 'breaker')} for t in self.tiers]
+            for t, tier in zip(tiers, self.tiers):
+                t['avg_latency_ms'] = round(t['latency_ms'] / t['calls'], 1) if t['calls'] else 0
+                t['circuit'] = tier['breaker'].state
+            return {
+                'calls': sum(t['calls'] for t in tiers),
+                'input_tokens': sum(t['input_tokens'] for t in tiers),
+                'output_tokens': sum(t['output_tokens'] for t in tiers),
+                'tiers': tiers,
+                'recent_calls': list(self.recent_calls)[-10:],
+            }
+
+    def classify_stages(self, batch):
+        """Stage-only classification for emails whose company and position are already known from their thread.
+
+        Returns {email id: {'interview_stage', 'confidence'}}; a much shorter prompt and reply than a full analysis.
+        Runs on the first (cheapest) tier only.
+        """
+        results, pending = {}, []
+        for email in batch:
+            if (cached := self.cache.get(self._stage_key(email))) is not None:
+                results[email['id']] = cached
+            else:
+                pending.append(email)
+
+        for chunk in self._split_batch(pending):
+            try:
+                parsed = self._parse_json(self._generate(stage_prompt(chunk), 0, len(chunk)).text)
+                items = {str(item.get('id')): item for item in parsed if isinstance(item, dict)}
+            except Exception as e:
+                print(f"❌ Gemini stage classification error: {e}")
+                items = {}
+
+            for e in chunk:
+                if (item := items.get(str(e['id']))) is None:
+                    results[e['id']] = {'interview_stage': None, 'confidence': 0, 'error': 'missing from response'}
+                    continue
+                try:
+                    cleaned = self._clean_result(item)
+                except (TypeError, ValueError) as error:
+                    # One malformed item (e.g. a null confidence) only sends that email back to full analysis
+                    results[e['id']] = {'interview_stage': None, 'confidence': 0, 'error': f'malformed item: {error}'}
+                    continue
+                results[e['id']] = {'interview_stage': cleaned['interview_stage'], 'confidence': cleaned['confidence']}
+                self.cache.put(self._stage_key(e), results[e['id']])
+        return results
+
+    def _stage_key(self, email):
+        return self.cache.make_key(email['subject'], email['body'], email.get('sender', ''), STAGE_PROMPT_VERSION, self.tiers[0]['name'])
+
+    def _split_batch(self, batch):
+        chunk, used = [], 0
+        for email in batch:
+            cost = estimate_email_tokens(email)
+            if chunk and (used + cost > BATCH_TOKEN_BUDGET or len(chunk) >= MAX_BATCH_SIZE):
+                yield chunk
+                chunk, used = [], 0
+            chunk.append(email)
+            used += cost
+        if chunk:
+            yield chunk
+
+    def _parse_json(self, text):
+        result_text = text.strip()
+        json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', result_text, re.DOTALL)
+        if json_match:
+            result_text = json_match.group(1).strip()
+        return json.loads(result_text)
+
+    def _clean_result(self, result):
+        def clean_value(value):
+            return None if value in [None, 'null', ''] else (value.strip() if isinstance(value, str) else value)
+
+        return {
+            'company_name': clean_value(result.get('company_name')),
+            'job_title': clean_value(result.get('job_title')),
+            'interview_stage': clean_value(result.get('interview_stage')),
+            'confidence': int(result.get('confidence', 0))
+        }
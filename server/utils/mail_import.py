@@ -0,0 +1,78 @@
+import json
+from email import policy
+from email.parser import BytesFeedParser
+from email.utils import parseaddr
+from utils.mime_text import clean_text, html_to_text
+
+BODY_LIMIT = 1000
+
+
+def message_to_email(message, index):
+    """Analyzer input ({'id', 'subject', 'sender', 'body'}) from a parsed email.message.EmailMessage."""
+    body = ''
+    try:
+        if part := message.get_body(preferencelist=('plain', 'html')):
+            content = part.get_content()
+            body = html_to_text(content) if part.get_content_type() == 'text/html' else content
+    except (KeyError, LookupError, ValueError):
+        pass
+    return {
+        'id': f'upload-{index}',
+        'message_id': str(message.get('Message-ID') or ''),
+        'subject': str(message.get('Subject') or 'No Subject'),
+        'sender': parseaddr(str(message.get('From') or ''))[1] or str(message.get('From') or ''),
+        'body': clean_text(body)[0][:BODY_LIMIT],
+    }
+
+
+def iter_mbox(stream):
+    """Messages of an mbox stream, parsed one at a time as their 'From ' separator lines go by."""
+    parser, index = None, 0
+    for line in stream:
+        if line.startswith(b'From '):
+            if parser is not None:
+                yield message_to_email(parser.close(), index)
+                index += 1
+            parser = BytesFeedParser(policy=policy.default)
+            continue
+        if parser is None:
+            parser = BytesFeedParser(policy=policy.default)
+        # mboxrd escapes body lines starting with 'From ' as '>From '
+        parser.feed(line[1:] if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From ') else line)
+    if parser is not None:
+        yield message_to_email(parser.close(), index)
+
+
+def iter_eml(stream):
+    parser = BytesFeedParser(policy=policy.default)
+    for line in stream:
+        parser.feed(line)
+    yield message_to_email(parser.close(), 0)
+
+
+def iter_json(items):
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'item {index} is not an object')
+        yield {
+            'id': f'upload-{index}',
+            'subject': item.get('subject') or item.get('email_subject') or '',
+            'sender': item.get('sender') or item.get('email_sender') or '',
+            'body': clean_text(item.get('body') or item.get('email_body') or '')[0][:BODY_LIMIT],
+        }
+
+
+def iter_upload(file_storage):
+    """Emails from an uploaded .mbox, .eml or JSON-array file, sniffing the format when the name doesn't tell."""
+    name, stream = (file_storage.filename or '').lower(), file_storage.stream
+    if name.endswith('.json'):
+        return iter_json(json.load(stream))
+    if name.endswith('.eml'):
+        return iter_eml(stream)
+    if name.endswith(('.mbox', '.mbx')):
+        return iter_mbox(stream)
+    head = stream.read(5)
+    stream.seek(0)
+    if head.lstrip().startswith(b'['):
+        return iter_json(json.load(stream))
+    return iter_mbox(stream) if head == b'From ' else iter_eml(stream)
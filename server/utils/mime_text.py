@@ -0,0 +1,125 @@
+import base64
+import codecs
+import re
+from html.parser import HTMLParser
+
+# base64 characters decoded per step; a multiple of 4 so every chunk decodes on its own
+CHUNK_CHARS = 4096
+_SKIP_TAGS = {'style', 'script', 'head', 'title', 'blockquote'}
+_BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'table'}
+
+# Everything from the first of these lines on is quoted history or a signature
+_CUT_MARKERS = re.compile(
+    r"^(?:On .{0,200}wrote:\s*$|-{2,}\s*Original Message\s*-{2,}|From: .+$\n^(?:Sent|Date): |-- ?$|Sent from my )",
+    re.MULTILINE | re.IGNORECASE,
+)
+_QUOTED_LINE = re.compile(r"^\s*>.*$\n?", re.MULTILINE)
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML-to-text; drops style/script/head and quoted (blockquote) content, decodes entities."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def clean_text(text):
+    """Drop quoted replies and signatures and collapse whitespace; returns (text, was_cut)."""
+    cut = bool(match := _CUT_MARKERS.search(text))
+    if cut:
+        text = text[:match.start()]
+    text = _QUOTED_LINE.sub('', text)
+    text = _BLANK_LINES.sub('\n\n', _WHITESPACE.sub(' ', text))
+    return text.strip(), cut
+
+
+def _charset(part):
+    for header in part.get('headers', []):
+        if header.get('name', '').lower() == 'content-type' and (m := re.search(r'charset="?([\w.-]+)', header.get('value', ''), re.I)):
+            try:
+                codecs.lookup(m.group(1))
+                return m.group(1)
+            except LookupError:
+                break
+    return 'utf-8'
+
+
+def _decode_part(part, limit):
+    """Decode a text part chunk by chunk, stopping once `limit` characters of clean text are available."""
+    data = part['body']['data']
+    decoder = codecs.getincrementaldecoder(_charset(part))(errors='replace')
+    html = part.get('mimeType') == 'text/html'
+    parser = _TextExtractor() if html else None
+    raw = []
+
+    for start in range(0, len(data), CHUNK_CHARS):
+        chunk = data[start:start + CHUNK_CHARS]
+        final = start + CHUNK_CHARS >= len(data)
+        try:
+            decoded = decoder.decode(base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4)), final=final)
+        except (ValueError, TypeError):
+            break
+        if html:
+            parser.feed(decoded)
+        else:
+            raw.append(decoded)
+        text, cut = clean_text(parser.text() if html else ''.join(raw))
+        if cut or len(text) >= limit:
+            return text[:limit]
+
+    if html:
+        parser.close()
+    return clean_text(parser.text() if html else ''.join(raw))[0][:limit]
+
+
+def _text_parts(payload):
+    """Depth-first walk over a Gmail message payload yielding inline text parts that carry data."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get('parts'):
+            stack.extend(reversed(part['parts']))
+            continue
+        is_attachment = part.get('filename') or part.get('body', {}).get('attachmentId')
+        if not is_attachment and part.get('mimeType') in ('text/plain', 'text/html') and part.get('body', {}).get('data'):
+            yield part
+
+
+def extract_text(payload, limit=1000):
+    """Readable body text of a message payload, preferring text/plain over text/html, capped at `limit` chars."""
+    parts = list(_text_parts(payload))
+    for mime_type in ('text/plain', 'text/html'):
+        for part in parts:
+            if part['mimeType'] == mime_type and (text := _decode_part(part, limit)):
+                return text
+    return ""
@@ -0,0 +1,115 @@
+import json
+import math
+import random
+import re
+import threading
+import zlib
+from utils import db
+
+N_FEATURES = 2 ** 18
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def hashed_features(email):
+    """Hashed unigram + bigram counts over subject, sender domain and body."""
+    sender = email.get('sender', '')
+    domain = sender.rsplit('@', 1)[-1].strip('> ').lower() if '@' in sender else ''
+    tokens = _TOKEN_RE.findall(f"{email.get('subject', '')} {email.get('body', '')}".lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] + ([f"@{domain}"] if domain else [])
+    features = {}
+    for gram in grams:
+        bucket = zlib.crc32(gram.encode('utf-8')) % N_FEATURES
+        features[bucket] = features.get(bucket, 0) + 1
+    return features
+
+
+class RelevancePrefilter:
+    """Incremental multinomial naive Bayes deciding whether an email is worth sending to the LLM.
+
+    Trained from the analyzer's own verdicts. Only skips an email once both classes have enough examples
+    and P(relevant) is below skip_threshold; a small explore_rate of would-be skips still goes to the LLM
+    so the model keeps seeing fresh labels.
+    """
+
+    STATE_NAME = 'relevance_prefilter'
+
+    def __init__(self, skip_threshold=0.02, min_examples=50, explore_rate=0.05, save_every=25):
+        self.skip_threshold = skip_threshold
+        self.min_examples = min_examples
+        self.explore_rate = explore_rate
+        self.save_every = save_every
+        self.counts = {True: {}, False: {}}
+        self.totals = {True: 0, False: 0}
+        self.docs = {True: 0, False: 0}
+        self.skipped = self.passed = self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            if state := db.get_model_state(self.STATE_NAME):
+                data = json.loads(state)
+                for label, key in ((True, 'relevant'), (False, 'irrelevant')):
+                    self.counts[label] = {int(k): v for k, v in data[key]['counts'].items()}
+                    self.totals[label] = data[key]['total']
+                    self.docs[label] = data[key]['docs']
+        except Exception as e:
+            print(f"⚠️ Could not load prefilter state: {e}")
+
+    def save(self):
+        with self._lock:
+            state = json.dumps({key: {'counts': self.counts[label], 'total': self.totals[label], 'docs': self.docs[label]}
+                                for label, key in ((True, 'relevant'), (False, 'irrelevant'))})
+            self._unsaved = 0
+        db.save_model_state(self.STATE_NAME, state)
+
+    def is_trained(self):
+        return min(self.docs.values()) >= self.min_examples
+
+    def relevance_probability(self, email):
+        features = hashed_features(email)
+        with self._lock:
+            total_docs = self.docs[True] + self.docs[False]
+            scores = {}
+            for label in (True, False):
+                counts, denominator = self.counts[label], self.totals[label] + N_FEATURES
+                score = math.log((self.docs[label] + 1) / (total_docs + 2))
+                for bucket, n in features.items():
+                    score += n * math.log((counts.get(bucket, 0) + 1) / denominator)
+                scores[label] = score
+        # Softmax over the two log scores, written to avoid overflow
+        return 1 / (1 + math.exp(max(-700, min(700, scores[False] - scores[True]))))
+
+    def should_skip(self, email):
+        skip = self.is_trained() and self.relevance_probability(email) < self.skip_threshold and random.random() >= self.explore_rate
+        with self._lock:
+            if skip:
+                self.skipped += 1
+            else:
+                self.passed += 1
+        return skip
+
+    def learn(self, email, relevant):
+        features = hashed_features(email)
+        with self._lock:
+            counts = self.counts[relevant]
+            for bucket, n in features.items():
+                counts[bucket] = counts.get(bucket, 0) + n
+            self.totals[relevant] += sum(features.values())
+            self.docs[relevant] += 1
+            self._unsaved += 1
+            save = self._unsaved >= self.save_every
+        if save:
+            try:
+                self.save()
+            except Exception as e:
+                print(f"⚠️ Could not save prefilter state: {e}")
+
+    def stats(self):
+        return {
+            'trained': self.is_trained(),
+            'relevant_examples': self.docs[True],
+            'irrelevant_examples': self.docs[False],
+            'skipped': self.skipped,
+            'passed': self.passed,
+        }
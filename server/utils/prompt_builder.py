@@ -0,0 +1,89 @@
+import json
+import os
+import re
+from functools import lru_cache
+from utils.mime_text import clean_text
+
+STAGES = "application_received, phone_screen, technical_interview, behavioral_interview, final_interview, offer, rejected, other"
+# Per-email body budget; ~4 characters per token for English mail
+BODY_TOKEN_BUDGET = int(os.getenv('GEMINI_BODY_TOKEN_BUDGET', 250))
+
+_URL = re.compile(r'https?://\S+|www\.\S+')
+_BOILERPLATE = re.compile(
+    r'unsubscribe|email preferences|manage (?:your )?(?:subscription|notifications)|privacy (?:policy|notice)|terms of (?:use|service)'
+    r'|all rights reserved|©|copyright \d{4}|view (?:this email )?in (?:your )?browser|do not reply|no-?reply'
+    r'|(?:this|the) (?:e-?mail|message)[^.]{0,80}(?:confidential|intended (?:solely )?for)|equal opportunity employer',
+    re.IGNORECASE,
+)
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n+')
+_SIGNAL = re.compile(
+    r'interview|application|appl(?:y|ied|ying)|position|role|offer|regret|unfortunately|congratulat|schedul|next steps'
+    r'|candidate|recruit|hiring|assessment|on-?site|phone screen|move forward|not (?:be )?(?:selected|moving)|availability',
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text):
+    return len(text or '') // 4 + 1
+
+
+@lru_cache(maxsize=2048)
+def compact_body(body, token_budget=BODY_TOKEN_BUDGET):
+    """Strip quoted history, links and legal/unsubscribe boilerplate, then keep the highest-signal sentences within budget."""
+    text, _ = clean_text(_URL.sub('', body or ''))
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(text) if s.strip() and not _BOILERPLATE.search(s)]
+    if estimate_tokens(' '.join(sentences)) <= token_budget:
+        return ' '.join(sentences)
+
+    # Rank by signal words; the opening sentences usually name the company and role, so they get a head start
+    ranked = sorted(range(len(sentences)), key=lambda i: (len(_SIGNAL.findall(sentences[i])) + (1 if i < 2 else 0), -i), reverse=True)
+    chosen, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost > token_budget:
+            continue
+        chosen.add(i)
+        used += cost
+    return ' '.join(sentences[i] for i in sorted(chosen))
+
+
+def _email_line(email, with_sender=True):
+    fields = {'id': email['id'], 'subject': email['subject']}
+    if with_sender:
+        fields['sender'] = email.get('sender', '')
+    fields['body'] = compact_body(email['body'])
+    return json.dumps(fields, ensure_ascii=False, separators=(',', ':'))
+
+
+def estimate_email_tokens(email):
+    return estimate_tokens(email.get('subject')) + estimate_tokens(compact_body(email.get('body'))) + estimate_tokens(email.get('sender')) + 12
+
+
+def analysis_prompt(subject, body, sender_email):
+    return (
+        "Extract job application info from this email.\n"
+        f"Subject: {subject}\nFrom: {sender_email}\nBody: {compact_body(body)}\n"
+        f"Stages: {STAGES}\n"
+        'Reply with only JSON: {"company_name": str|null, "job_title": str|null, "interview_stage": stage|null, "confidence": 0-100}'
+    )
+
+
+def batch_analysis_prompt(emails):
+    lines = "\n".join(_email_line(e) for e in emails)
+    return (
+        "Extract job application info from each email (one JSON object per line).\n"
+        f"{lines}\n"
+        f"Stages: {STAGES}\n"
+        'Reply with only a JSON array, one object per email: '
+        '[{"id": same id, "company_name": str|null, "job_title": str|null, "interview_stage": stage|null, "confidence": 0-100}]'
+    )
+
+
+def stage_prompt(emails):
+    lines = "\n".join(_email_line(e, with_sender=False) for e in emails)
+    return (
+        "Each line is an email in an ongoing job application conversation. Classify its interview stage.\n"
+        f"{lines}\n"
+        f"Stages: {STAGES}\n"
+        'Reply with only a JSON array: [{"id": same id, "interview_stage": stage, "confidence": 0-100}]'
+    )
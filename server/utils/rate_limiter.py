@@ -0,0 +1,215 @@
+import os
+import random
+import threading
+import time
+
+# Published defaults: Gmail allows 250 quota units per user per second (messages.get/list cost 5, history.list 2);
+# Gemini free tier allows 15 requests/minute for 1.5 Flash and 2 for 1.5 Pro. Override for paid quotas.
+GMAIL_UNITS_PER_SECOND = float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', 250))
+GEMINI_RPM = {
+    'gemini-1.5-flash-8b': float(os.getenv('GEMINI_FLASH_8B_RPM', 15)),
+    'gemini-1.5-flash': float(os.getenv('GEMINI_FLASH_RPM', 15)),
+    'gemini-1.5-pro': float(os.getenv('GEMINI_PRO_RPM', 2)),
+}
+DEFAULT_GEMINI_RPM = float(os.getenv('GEMINI_DEFAULT_RPM', 15))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until `tokens` are available; returns False if that would take longer than `timeout` seconds.
+
+        The full amount is reserved up front, even beyond capacity: the bucket goes into debt and callers sleep
+        off the deficit in turn, so large batches are charged for every unit they use.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (tokens - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return False
+            self.tokens -= tokens
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_timeout` seconds one trial call is let through."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    print(f"⚠️ {self.name} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+def is_retryable(error):
+    """Rate limiting, server-side and timeout errors from either Google client library."""
+    status = getattr(getattr(error, 'resp', None), 'status', None) or getattr(error, 'code', None)
+    if isinstance(status, int) and (status == 429 or 500 <= status < 600):
+        return True
+    if status == 403 and any(reason in str(error) for reason in ('rateLimitExceeded', 'userRateLimitExceeded')):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in ('ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'TooManyRequests')
+
+
+def backoff_delay(attempt, base=1.0, cap=32.0):
+    """Full-jitter exponential backoff so parked callers don't retry in lockstep."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(fn, breaker=None, limiter=None, tokens=1, max_attempts=4):
+    """Run fn() under a rate limiter and circuit breaker, retrying transient errors with jittered backoff."""
+    for attempt in range(max_attempts):
+        if breaker and not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} is degraded; call parked")
+        if limiter:
+            limiter.acquire(tokens)
+        try:
+            result = fn()
+        except Exception as e:
+            if not is_retryable(e):
+                # The API answered; the request itself was bad
+                if breaker:
+                    breaker.record_success()
+                raise
+            if breaker:
+                breaker.record_failure()
+            if attempt == max_attempts - 1:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
+
+
+class RetryQueue:
+    """Keys parked while an API is degraded, each released again after a growing, jittered delay."""
+
+    def __init__(self, max_attempts=8, base=5.0, cap=600.0, capacity=10000):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.capacity = capacity
+        self.parked = {}
+        self.attempts = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def park(self, key):
+        """Schedule key for a retry; returns False once it has used up its attempts."""
+        with self._lock:
+            attempt = self.attempts.get(key, 0)
+            if attempt >= self.max_attempts or (key not in self.parked and len(self.parked) >= self.capacity):
+                self.attempts.pop(key, None)
+                self.parked.pop(key, None)
+                self.dropped += 1
+                return False
+            self.attempts[key] = attempt + 1
+            self.parked[key] = time.monotonic() + random.uniform(0.5, 1.0) * min(self.cap, self.base * 2 ** attempt)
+            return True
+
+    def due(self):
+        """Pop the keys whose delay has passed; their attempt counts are kept until discard()."""
+        now = time.monotonic()
+        with self._lock:
+            ready = [key for key, at in self.parked.items() if at <= now]
+            for key in ready:
+                del self.parked[key]
+            return ready
+
+    def discard(self, key):
+        with self._lock:
+            self.parked.pop(key, None)
+            self.attempts.pop(key, None)
+
+    def __contains__(self, key):
+        # Released keys keep their attempt count until discard(), so they still count as unresolved
+        return key in self.attempts
+
+    def __len__(self):
+        return len(self.parked)
+
+    def stats(self):
+        return {'parked': len(self.parked), 'dropped': self.dropped}
+
+
+_limiters = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def gmail_limiter(user):
+    with _registry_lock:
+        if (key := ('gmail', user)) not in _limiters:
+            _limiters[key] = TokenBucket(GMAIL_UNITS_PER_SECOND, GMAIL_UNITS_PER_SECOND)
+        return _limiters[key]
+
+
+def gemini_limiter(model_name):
+    with _registry_lock:
+        if (key := ('gemini', model_name)) not in _limiters:
+            rpm = GEMINI_RPM.get(model_name, DEFAULT_GEMINI_RPM)
+            _limiters[key] = TokenBucket(rpm / 60, max(1, rpm / 4))
+        return _limiters[key]
+
+
+def get_breaker(name):
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_states():
+    with _registry_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
@@ -0,0 +1,127 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+_WORD_RE = re.compile(r"[\w'&.-]+")
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(tokens, shingle=3):
+    """64-bit SimHash over word shingles, with capitalized words masked.
+
+    Masking makes template mail that differs only in names, companies and titles hash (nearly) identically.
+    """
+    words = ['<cap>' if t[:1].isupper() else t.lower() for t in tokens]
+    grams = [' '.join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    weights = [0] * 64
+    for gram in grams:
+        h = _hash64(gram)
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """Fingerprints of analyzed emails, used to reuse a prior analysis for near-identical templated mail.
+
+    Candidates are found by banding: with max_distance < BANDS, any fingerprint within that Hamming distance
+    shares at least one 16-bit band exactly. A reused result has the entities that differ between the two
+    emails (e.g. the company in "Thank you for applying to X") substituted, and is only returned when the
+    substituted company and job title actually appear in the new email.
+    """
+
+    def __init__(self, max_distance=3, capacity=5000, min_tokens=12):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        self.min_tokens = min_tokens
+        self.entries = OrderedDict()
+        self.bands = [{} for _ in range(BANDS)]
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tokens(email):
+        return _WORD_RE.findall(f"{email.get('subject', '')} {email.get('body', '')}")
+
+    @staticmethod
+    def _band_keys(fingerprint):
+        mask = (1 << BAND_BITS) - 1
+        return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+    def add(self, email, result):
+        if len(tokens := self._tokens(email)) < self.min_tokens:
+            return
+        fingerprint = simhash(tokens)
+        with self._lock:
+            if fingerprint in self.entries:
+                self.entries.move_to_end(fingerprint)
+                return
+            self.entries[fingerprint] = (tokens, dict(result))
+            for band, key in zip(self.bands, self._band_keys(fingerprint)):
+                band.setdefault(key, set()).add(fingerprint)
+            while len(self.entries) > self.capacity:
+                old, _ = self.entries.popitem(last=False)
+                for band, key in zip(self.bands, self._band_keys(old)):
+                    if (bucket := band.get(key)) is not None:
+                        bucket.discard(old)
+                        if not bucket:
+                            del band[key]
+
+    def lookup(self, email):
+        """A result adapted from a near-duplicate prior email, or None."""
+        if len(tokens := self._tokens(email)) < self.min_tokens:
+            return None
+        fingerprint = simhash(tokens)
+        with self._lock:
+            candidates = set().union(*(band.get(key, ()) for band, key in zip(self.bands, self._band_keys(fingerprint))))
+            best = min(candidates, key=lambda c: hamming(c, fingerprint), default=None)
+            if best is None or hamming(best, fingerprint) > self.max_distance:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            prior_tokens, prior_result = self.entries[best]
+
+        if (result := self._adapt(prior_tokens, prior_result, tokens)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def _adapt(self, prior_tokens, prior_result, tokens):
+        prior_lower, lower = [t.lower() for t in prior_tokens], [t.lower() for t in tokens]
+        matcher = SequenceMatcher(None, prior_lower, lower, autojunk=False)
+        replacements = [(' '.join(prior_tokens[i1:i2]), ' '.join(tokens[j1:j2]))
+                        for op, i1, i2, j1, j2 in matcher.get_opcodes() if op == 'replace']
+        prior_text, text = ' '.join(prior_lower), ' '.join(lower)
+
+        result = dict(prior_result)
+        for field in ('company_name', 'job_title'):
+            if not result.get(field):
+                continue
+            value = ' '.join(_WORD_RE.findall(result[field]))
+            # Only values lifted verbatim from the prior email can be mapped onto the new one
+            if value.lower() not in prior_text:
+                return None
+            substituted = value
+            for old, new in replacements:
+                if old.lower() in substituted.lower():
+                    substituted = re.sub(re.escape(old), new, substituted, flags=re.IGNORECASE)
+            if substituted.lower() not in text:
+                return None
+            if substituted != value:
+                result[field] = substituted
+        return result
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}